@@ -0,0 +1,82 @@
+import zlib
+from array import array
+from collections.abc import Sequence
+from functools import lru_cache
+
+from APP.services import index_store
+
+# corpus.bin holds the full text of every indexed chunk, in doc ID order, in
+# the same section container as index.bin:
+#
+#   meta    JSON metadata: N, the index version it belongs to, compression
+#   docoff  uint64[N + 1] offsets into "docs"
+#   docs    per document: UTF-8 text, zlib-compressed when compression is "zlib"
+
+DOC_CACHE_SIZE = 128
+COMPRESSION_LEVEL = 6
+
+
+class DocumentWriter:
+    """Collects encoded documents in doc ID order and writes them as corpus.bin."""
+
+    def __init__(self, compress=True):
+        self.compression = "zlib" if compress else None
+        self._offsets = array("Q", [0])
+        self._blob = bytearray()
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def append(self, text):
+        data = text.encode("utf-8")
+        if self.compression == "zlib":
+            data = zlib.compress(data, COMPRESSION_LEVEL)
+        self._append_encoded(data)
+
+    def copy_from(self, store, doc_id):
+        """Appends a document from another store without re-encoding it when possible."""
+        if store.compression == self.compression:
+            self._append_encoded(store.raw(doc_id))
+        else:
+            self.append(store[doc_id])
+
+    def _append_encoded(self, data):
+        self._blob += data
+        self._offsets.append(len(self._blob))
+
+    def write(self, path, version):
+        meta = {"N": len(self), "version": version, "compression": self.compression}
+        index_store.write_index(path, meta, {"docoff": self._offsets, "docs": self._blob})
+
+
+class DocumentStore(Sequence):
+    """doc_id -> full text, read from the mmapped corpus.bin on access.
+
+    Only the most recently used texts are kept decoded, so resident memory
+    does not grow with the corpus.
+    """
+
+    def __init__(self, path, cache_size=DOC_CACHE_SIZE):
+        self._file = index_store.MappedFile(path)
+        self.meta = self._file.meta
+        self.compression = self.meta.get("compression")
+        self._offsets = self._file.sections["docoff"].cast("Q")
+        self._blob = self._file.sections["docs"]
+        self._text = lru_cache(maxsize=cache_size)(self._decode)
+
+    def raw(self, doc_id):
+        return bytes(self._blob[self._offsets[doc_id]:self._offsets[doc_id + 1]])
+
+    def _decode(self, doc_id):
+        data = self.raw(doc_id)
+        if self.compression == "zlib":
+            data = zlib.decompress(data)
+        return data.decode("utf-8")
+
+    def __getitem__(self, doc_id):
+        if not 0 <= doc_id < len(self):
+            raise IndexError(doc_id)
+        return self._text(doc_id)
+
+    def __len__(self):
+        return len(self._offsets) - 1
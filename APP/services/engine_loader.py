@@ -0,0 +1,107 @@
+import time
+import threading
+
+from APP.services.ir_engine import IREngine
+from APP.services.summarizer import Summarizer
+from APP.services.nltk_resources import ensure_nltk_resources
+
+
+class EngineLoader:
+    """Builds the IREngine and Summarizer off the request path.
+
+    start() runs load() on a daemon thread so the web UI comes up at once;
+    until the engine is ready, status() describes how far loading has got.
+    Per-stage timings are kept so cold start cost stays measurable.
+    """
+
+    def __init__(self, processed_data_folder, on_ready=None, engine_options=None):
+        self.processed_data_folder = processed_data_folder
+        self.on_ready = on_ready
+        # Extra IREngine keyword arguments, e.g. scoring_backend.
+        self.engine_options = engine_options or {}
+
+        self.state = "pending"
+        self.stage = None
+        self.done = 0
+        self.total = 0
+        self.error = None
+        self.timings = {}
+
+        self.ir_engine = None
+        self.summarizer = None
+
+        self._started = None
+        self._stage_started = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.load, name="engine-loader", daemon=True)
+        self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def load(self):
+        self.state = "loading"
+        self._started = time.perf_counter()
+
+        try:
+            self._progress("nltk", 0, 1)
+            ensure_nltk_resources()
+
+            ir_engine = IREngine(self.processed_data_folder, progress=self._progress, **self.engine_options)
+
+            self._progress("summarizer", 0, 1)
+            summarizer = Summarizer(ir_engine)
+
+            # Inside the try: if the callback fails, waiters must still be
+            # released and see "failed" rather than warming up forever.
+            if self.on_ready is not None:
+                self.on_ready(ir_engine, summarizer)
+            self._progress("ready", 1, 1)
+        except Exception as e:
+            print(f"Loading the IR engine failed: {e}")
+            self.error = str(e)
+            self.state = "failed"
+            self._ready.set()
+            return
+
+        self.ir_engine = ir_engine
+        self.summarizer = summarizer
+        self.state = "ready"
+        self._ready.set()
+        print(f"IR Engine and Summarizer initialized in {self.timings['total']:.2f}s.")
+
+    def _progress(self, stage, done, total):
+        now = time.perf_counter()
+        if stage != self.stage:
+            if self.stage is not None:
+                self.timings[self.stage] = self.timings.get(self.stage, 0.0) + now - self._stage_started
+            self.stage = stage
+            self._stage_started = now
+        self.done = done
+        self.total = total
+        self.timings["total"] = now - self._started
+
+    def status(self):
+        warming_up = self.state in ("pending", "loading")
+        if warming_up and self._started is not None:
+            elapsed = time.perf_counter() - self._started
+        else:
+            elapsed = self.timings.get("total", 0.0)
+
+        return {
+            "status": "warming_up" if warming_up else self.state,
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "elapsed": round(elapsed, 3),
+            "timings": {stage: round(t, 3) for stage, t in self.timings.items()},
+            "error": self.error,
+        }
@@ -0,0 +1,539 @@
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+from collections.abc import Mapping, Sequence
+from functools import lru_cache
+from itertools import accumulate
+
+import numpy as np
+
+from APP.services import spelling
+
+# On-disk layout of index.bin:
+#
+#   header    magic, format version, byte order, number of sections
+#   table     one (name, offset, length) entry per section
+#   sections  8-byte aligned blobs, read in place through mmap
+#
+# Sections written by IREngine:
+#   meta      JSON metadata: N, avgdl, BM25 parameters, the source labels
+#             and the manifest of indexed files (doc ID order)
+#   termoff   uint64[V + 1] offsets into "terms"
+#   terms     sorted UTF-8 term strings, concatenated (term ID = position)
+#   wordoff   uint64[V + 1] offsets into "words"
+#   words     per term ID, the word shown for it in suggestions (the most
+#             frequent token that normalizes to the term)
+#   postoff   uint64[V + 1] offsets into "postings"
+#   postings  per term: varint (doc_id delta, freq) pairs
+#   df        uint32[V] document frequency per term
+#   norms     float64[N] TF-IDF vector length per document
+#   doclen    uint32[N] token count per document
+#   bm25doc   uint32[P] per term, doc IDs in doc ID order (P = total postings;
+#             term t starts at the sum of df of the terms before it)
+#   bm25imp   float32[P] BM25 impact of each posting, same order as bm25doc
+#   impdoc    uint32[P] per term, doc IDs by descending impact (ties by doc ID)
+#   impact    float32[P] impacts in the same order as impdoc
+#   srcbits   one doc ID bitmap per source label, in meta "sources" order,
+#             each (N + 7) // 8 bytes (numpy packbits bit order)
+#   spellkey  uint32 sorted CRC32 keys of the symmetric deletes of every
+#             spellable word (see APP.services.spelling)
+#   spellids  uint32 term ID of the word each key was generated from
+#   paraoff   uint64[N + 1] offsets into "paras"
+#   paras     per document: varint paragraph count, then per paragraph the
+#             cleaned UTF-8 text (varint length + bytes) and varint
+#             (term ID, tf) pairs
+#
+# Only in indexes built with positions (meta "positional"):
+#   posoff    uint64[P + 1] offsets into "posdata", one per posting in
+#             bm25doc order
+#   posdata   per posting: varint deltas of the term's token offsets in the
+#             document (stopwords and punctuation count as tokens)
+
+MAGIC = b"NSIX"
+FORMAT_VERSION = 6
+
+TERM_ID_CACHE_SIZE = 65536
+
+_HEADER = struct.Struct("<4sIII")
+_SECTION = struct.Struct("<8sQQ")
+_LITTLE_ENDIAN = 1 if sys.byteorder == "little" else 0
+
+
+def encode_varints(values, out):
+    for v in values:
+        while v >= 0x80:
+            out.append((v & 0x7F) | 0x80)
+            v >>= 7
+        out.append(v)
+
+
+def decode_varints(buf):
+    values = []
+    v = shift = 0
+    for byte in buf:
+        v |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(v)
+            v = shift = 0
+    return values
+
+
+def encode_postings(postings, out):
+    values = []
+    prev = 0
+    for doc_id, freq in postings:
+        values.append(doc_id - prev)
+        values.append(freq)
+        prev = doc_id
+    encode_varints(values, out)
+
+
+def decode_postings(buf):
+    values = decode_varints(buf)
+    postings = []
+    doc_id = 0
+    for i in range(0, len(values), 2):
+        doc_id += values[i]
+        postings.append((doc_id, values[i + 1]))
+    return postings
+
+
+def encode_positions(positions):
+    values = []
+    prev = 0
+    for pos in positions:
+        values.append(pos - prev)
+        prev = pos
+    out = bytearray()
+    encode_varints(values, out)
+    return bytes(out)
+
+
+def decode_positions(buf):
+    return list(accumulate(decode_varints(buf)))
+
+
+def build_term_sections(inverted_index, words=None):
+    """words: term -> its "words" entry; terms missing from it are their own word."""
+    terms = sorted(inverted_index)
+
+    term_blob = bytearray()
+    term_offsets = array("Q", [0])
+    word_blob = bytearray()
+    word_offsets = array("Q", [0])
+    postings_blob = bytearray()
+    postings_offsets = array("Q", [0])
+    df = array("I")
+
+    for term in terms:
+        term_blob += term.encode("utf-8")
+        term_offsets.append(len(term_blob))
+        word_blob += (words.get(term, term) if words else term).encode("utf-8")
+        word_offsets.append(len(word_blob))
+
+        postings = inverted_index[term]
+        encode_postings(postings, postings_blob)
+        postings_offsets.append(len(postings_blob))
+        df.append(len(postings))
+
+    return {
+        "termoff": term_offsets,
+        "terms": term_blob,
+        "wordoff": word_offsets,
+        "words": word_blob,
+        "postoff": postings_offsets,
+        "postings": postings_blob,
+        "df": df,
+    }
+
+
+def build_paragraph_sections(doc_paragraphs, inverted_index):
+    term_ids = {term: i for i, term in enumerate(sorted(inverted_index))}
+
+    blob = bytearray()
+    offsets = array("Q", [0])
+
+    for paragraphs in doc_paragraphs:
+        encode_varints([len(paragraphs)], blob)
+        for text, tf in paragraphs:
+            data = text.encode("utf-8")
+            encode_varints([len(data)], blob)
+            blob += data
+
+            # Terms outside the vocabulary have df 0 and can never score.
+            pairs = [(term_ids[t], freq) for t, freq in tf.items() if t in term_ids]
+            values = [len(pairs)]
+            for term_id, freq in pairs:
+                values.append(term_id)
+                values.append(freq)
+            encode_varints(values, blob)
+
+        offsets.append(len(blob))
+
+    return {"paraoff": offsets, "paras": blob}
+
+
+def build_position_sections(term_positions):
+    """term_positions: term -> encoded positions per posting, in postings order."""
+    blob = bytearray()
+    offsets = array("Q", [0])
+
+    for term in sorted(term_positions):
+        for data in term_positions[term]:
+            blob += data
+            offsets.append(len(blob))
+
+    return {"posoff": offsets, "posdata": blob}
+
+
+def build_source_sections(doc_sources):
+    """doc_sources: source label per doc ID. Returns (labels, sections)."""
+    labels = sorted(set(doc_sources))
+    ids = {label: i for i, label in enumerate(labels)}
+    doc_source_ids = np.fromiter((ids[label] for label in doc_sources), dtype=np.uint8, count=len(doc_sources))
+
+    bitmaps = [np.packbits(doc_source_ids == i) for i in range(len(labels))]
+    blob = np.concatenate(bitmaps) if bitmaps else np.zeros(0, dtype=np.uint8)
+    return labels, {"srcbits": blob}
+
+
+def build_spelling_sections(term_sections):
+    """Symmetric delete index over the "words" written by build_term_sections;
+    words seen in fewer than spelling.MIN_DF documents are left out."""
+    word_offsets = term_sections["wordoff"]
+    words = bytes(term_sections["words"])
+    df = term_sections["df"]
+
+    keys = array("I")
+    term_ids = array("I")
+    for term_id in range(len(df)):
+        word = words[word_offsets[term_id]:word_offsets[term_id + 1]].decode("utf-8")
+        if df[term_id] < spelling.MIN_DF or len(word) < spelling.MIN_DICTIONARY_LENGTH or not word.isalpha():
+            continue
+        for deleted in spelling.deletes(word):
+            keys.append(spelling.delete_key(deleted))
+            term_ids.append(term_id)
+
+    keys = np.frombuffer(keys, dtype=np.uint32)
+    order = np.argsort(keys, kind="stable")
+    return {"spellkey": keys[order], "spellids": np.frombuffer(term_ids, dtype=np.uint32)[order]}
+
+
+def write_index(path, meta, sections):
+    """Writes meta plus the named sections atomically to path."""
+    sections = {"meta": json.dumps(meta).encode("utf-8"), **sections}
+    blobs = [(name.encode("ascii"), bytes(data)) for name, data in sections.items()]
+    for name, _ in blobs:
+        if len(name) > 8:
+            raise ValueError(f"Section name {name.decode()!r} is longer than 8 bytes")
+
+    offset = _HEADER.size + _SECTION.size * len(blobs)
+    table = []
+    for name, data in blobs:
+        offset += -offset % 8
+        table.append((name, offset, len(data)))
+        offset += len(data)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, _LITTLE_ENDIAN, len(blobs)))
+        for entry in table:
+            f.write(_SECTION.pack(*entry))
+        for (name, data), (_, start, _) in zip(blobs, table):
+            f.write(b"\0" * (start - f.tell()))
+            f.write(data)
+
+    # Readers that already mmapped the old file keep their pages.
+    os.replace(tmp_path, path)
+
+
+class MappedTermPostings(Mapping):
+    """Read-only term -> [(doc_id, freq), ...] view over the mmapped sections."""
+
+    def __init__(self, sections):
+        self._term_offsets = sections["termoff"].cast("Q")
+        self._terms = sections["terms"]
+        self._word_offsets = sections["wordoff"].cast("Q")
+        self._words = sections["words"]
+        self._postings_offsets = sections["postoff"].cast("Q")
+        self._postings = sections["postings"]
+        self._df = sections["df"].cast("I")
+        self.df = MappedDocFreqs(self)
+        self.term_id = lru_cache(maxsize=TERM_ID_CACHE_SIZE)(self._find_term_id)
+
+    def _term_bytes(self, term_id):
+        return bytes(self._terms[self._term_offsets[term_id]:self._term_offsets[term_id + 1]])
+
+    def term(self, term_id):
+        return self._term_bytes(term_id).decode("utf-8")
+
+    def word(self, term_id):
+        return bytes(self._words[self._word_offsets[term_id]:self._word_offsets[term_id + 1]]).decode("utf-8")
+
+    def vocabulary(self):
+        """(display word, document frequency) of every term, in term ID order."""
+        for term_id in range(len(self)):
+            yield self.word(term_id), self._df[term_id]
+
+    def _find_term_id(self, term):
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self._term_bytes(lo) == key:
+            return lo
+        return -1
+
+    def postings(self, term_id):
+        start = self._postings_offsets[term_id]
+        end = self._postings_offsets[term_id + 1]
+        return decode_postings(self._postings[start:end])
+
+    def __getitem__(self, term):
+        term_id = self.term_id(term)
+        if term_id < 0:
+            raise KeyError(term)
+        return self.postings(term_id)
+
+    def __contains__(self, term):
+        return self.term_id(term) >= 0
+
+    def __iter__(self):
+        for term_id in range(len(self)):
+            yield self.term(term_id)
+
+    def items(self):
+        # Walks term IDs directly instead of looking every term up again.
+        for term_id in range(len(self)):
+            yield self.term(term_id), self.postings(term_id)
+
+    def __len__(self):
+        return len(self._df)
+
+
+class MappedDocFreqs(Mapping):
+    """Term -> document frequency, answered without decoding postings."""
+
+    def __init__(self, postings):
+        self._postings = postings
+
+    def __getitem__(self, term):
+        term_id = self._postings.term_id(term)
+        if term_id < 0:
+            raise KeyError(term)
+        return self._postings._df[term_id]
+
+    def __iter__(self):
+        return iter(self._postings)
+
+    def __len__(self):
+        return len(self._postings)
+
+
+def posting_offsets(sections):
+    """int64[V + 1] index of each term's first posting in the per-posting sections."""
+    df = np.frombuffer(sections["df"], dtype=np.uint32)
+    return np.concatenate(([0], np.cumsum(df, dtype=np.int64)))
+
+
+class MappedImpacts:
+    """Precomputed BM25 impacts per term, in doc ID order for random access and
+    in impact order for early termination. Slices are zero-copy numpy views."""
+
+    def __init__(self, sections):
+        self._offsets = posting_offsets(sections)
+        self._docs = np.frombuffer(sections["bm25doc"], dtype=np.uint32)
+        self._impacts = np.frombuffer(sections["bm25imp"], dtype=np.float32)
+        self._impact_docs = np.frombuffer(sections["impdoc"], dtype=np.uint32)
+        self._sorted_impacts = np.frombuffer(sections["impact"], dtype=np.float32)
+
+    def by_doc(self, term_id):
+        start, end = self._offsets[term_id], self._offsets[term_id + 1]
+        return self._docs[start:end], self._impacts[start:end]
+
+    def by_impact(self, term_id):
+        start, end = self._offsets[term_id], self._offsets[term_id + 1]
+        return self._impact_docs[start:end], self._sorted_impacts[start:end]
+
+
+class MappedPositions(Mapping):
+    """Term -> encoded positions per posting, plus decoded access by term ID
+    and index into the term's doc-ordered postings."""
+
+    def __init__(self, sections, postings):
+        self._term_starts = posting_offsets(sections)
+        self._docs = np.frombuffer(sections["bm25doc"], dtype=np.uint32)
+        self._offsets = sections["posoff"].cast("Q")
+        self._blob = sections["posdata"]
+        self._postings = postings
+
+    def docs(self, term_id):
+        """Doc IDs of the term's postings, ascending, as a zero-copy numpy view."""
+        return self._docs[self._term_starts[term_id]:self._term_starts[term_id + 1]]
+
+    def _raw(self, posting):
+        return self._blob[self._offsets[posting]:self._offsets[posting + 1]]
+
+    def positions(self, term_id, i):
+        """Token offsets of the term in its i-th posting."""
+        return decode_positions(self._raw(int(self._term_starts[term_id]) + i))
+
+    def __getitem__(self, term):
+        term_id = self._postings.term_id(term)
+        if term_id < 0:
+            raise KeyError(term)
+        start, end = int(self._term_starts[term_id]), int(self._term_starts[term_id + 1])
+        return [bytes(self._raw(posting)) for posting in range(start, end)]
+
+    def __iter__(self):
+        return iter(self._postings)
+
+    def __len__(self):
+        return len(self._postings)
+
+
+class MappedSources:
+    """Source label of every document, with a doc ID bitmap per source."""
+
+    def __init__(self, sections, labels, n_docs):
+        self.labels = labels
+        size = (n_docs + 7) // 8
+        bits = np.frombuffer(sections["srcbits"], dtype=np.uint8)
+
+        self._masks = {}
+        self.doc_sources = np.zeros(n_docs, dtype=np.uint8)
+        for i, label in enumerate(labels):
+            mask = np.unpackbits(bits[i * size:(i + 1) * size], count=n_docs).view(bool)
+            self._masks[label] = mask
+            self.doc_sources[mask] = i
+
+    def label(self, doc_id):
+        return self.labels[self.doc_sources[doc_id]]
+
+    def mask(self, labels):
+        """Boolean doc ID mask of the documents from any of the given sources."""
+        masks = [self._masks[label] for label in labels]
+        return np.logical_or.reduce(masks) if len(masks) > 1 else masks[0]
+
+    def counts(self, doc_ids):
+        """{label: number of the given documents from that source}."""
+        counts = np.bincount(self.doc_sources[doc_ids], minlength=len(self.labels))
+        return dict(zip(self.labels, counts.tolist()))
+
+
+class MappedSpelling:
+    """Spelling corrections from the spellkey/spellids sections."""
+
+    def __init__(self, sections, postings):
+        self._keys = np.frombuffer(sections["spellkey"], dtype=np.uint32)
+        self._term_ids = np.frombuffer(sections["spellids"], dtype=np.uint32)
+        self._postings = postings
+
+    def correct(self, word):
+        """The indexed word closest to word (ties go to the higher document
+        frequency), or None if none is within spelling.max_distance_for(word)."""
+        max_distance = spelling.max_distance_for(word)
+        if not max_distance:
+            return None
+
+        keys = np.fromiter((spelling.delete_key(d) for d in spelling.deletes(word, max_distance)), dtype=np.uint32)
+        starts = np.searchsorted(self._keys, keys, side="left")
+        ends = np.searchsorted(self._keys, keys, side="right")
+        candidates = np.unique(np.concatenate([self._term_ids[a:b] for a, b in zip(starts, ends)]))
+
+        best = None
+        for term_id in candidates.tolist():
+            candidate = self._postings.word(term_id)
+            distance = spelling.edit_distance(word, candidate, max_distance)
+            if distance <= max_distance:
+                rank = (distance, -self._postings._df[term_id], candidate)
+                if best is None or rank < best:
+                    best = rank
+        return best[2] if best else None
+
+
+class MappedParagraphs(Sequence):
+    """doc_id -> [(cleaned_text, {term: tf}), ...] decoded on access."""
+
+    def __init__(self, sections, postings):
+        self._offsets = sections["paraoff"].cast("Q")
+        self._blob = sections["paras"]
+        self._postings = postings
+
+    def __getitem__(self, doc_id):
+        buf = self._blob[self._offsets[doc_id]:self._offsets[doc_id + 1]]
+        pos = 0
+
+        def read_varint():
+            nonlocal pos
+            v = shift = 0
+            while True:
+                byte = buf[pos]
+                pos += 1
+                v |= (byte & 0x7F) << shift
+                if not byte & 0x80:
+                    return v
+                shift += 7
+
+        paragraphs = []
+        for _ in range(read_varint()):
+            length = read_varint()
+            text = bytes(buf[pos:pos + length]).decode("utf-8")
+            pos += length
+
+            tf = {}
+            for _ in range(read_varint()):
+                term_id = read_varint()
+                tf[self._postings.term(term_id)] = read_varint()
+            paragraphs.append((text, tf))
+
+        return paragraphs
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+
+class MappedFile:
+    """Header, section table and meta of a file written by write_index."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        buf = memoryview(self._mm)
+        magic, version, byte_order, count = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an index file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format version {version}")
+        if byte_order != _LITTLE_ENDIAN:
+            raise ValueError("Index was written on a machine with a different byte order")
+
+        self.sections = {}
+        for i in range(count):
+            name, start, length = _SECTION.unpack_from(buf, _HEADER.size + i * _SECTION.size)
+            self.sections[name.rstrip(b"\0").decode("ascii")] = buf[start:start + length]
+
+        self.meta = json.loads(bytes(self.sections["meta"]))
+
+
+class MappedIndex(MappedFile):
+    def __init__(self, path):
+        super().__init__(path)
+        self.postings = MappedTermPostings(self.sections)
+        self.norms = self.sections["norms"].cast("d")
+        self.doc_lengths = self.sections["doclen"].cast("I")
+        self.impacts = MappedImpacts(self.sections)
+        self.sources = MappedSources(self.sections, self.meta["sources"], self.meta["N"])
+        self.spelling = MappedSpelling(self.sections, self.postings)
+        self.positions = MappedPositions(self.sections, self.postings) if "posoff" in self.sections else None
+        self.paragraphs = MappedParagraphs(self.sections, self.postings)
@@ -2,158 +2,610 @@ import nltk
 import math
 import re
 import os
-import json
+import heapq
+import hashlib
+import threading
+from array import array
+
+import numpy as np
+from scipy.sparse import csr_matrix
 
 from nltk.tokenize import word_tokenize
 from nltk.stem import WordNetLemmatizer, PorterStemmer
 from nltk.corpus import stopwords
-from collections import defaultdict
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from APP.services import doc_store, index_store, spelling
+from APP.services.metrics import METRICS
+from APP.services.sources import source_label_for, strip_source_tag
+
+TOKEN_CACHE_SIZE = 200000
+TOP_K = 50
+
+# "postings" scores term-at-a-time over the mmapped postings; "csr" multiplies
+# the query by the cached term x doc matrix (see term_doc_matrix).
+SCORING_BACKENDS = ("postings", "csr")
+
+# "tfidf" is length-normalized TF-IDF cosine; "bm25" sums precomputed BM25
+# impacts. Chosen per engine and overridable per call.
+RANKING_MODELS = ("tfidf", "bm25")
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Starting depth into the impact-ordered lists; doubled until the bound holds.
+BM25_BLOCK_SIZE = 128
+# Past this share of a query's postings, random access into the doc-ordered
+# lists costs more than scoring every posting.
+BM25_MAX_HEAD_FRACTION = 0.25
+
+# With a positional index, multi-term rankings are reranked by how close the
+# query terms occur: the top PROXIMITY_CANDIDATES scores are multiplied by up
+# to 1 + PROXIMITY_WEIGHT (every pair of consecutive query terms adjacent).
+PROXIMITY_WEIGHT = 0.5
+PROXIMITY_CANDIDATES = 100
+
+NON_ALNUM_RE = re.compile(r"[^a-z0-9]")
+PHRASE_RE = re.compile(r'"([^"]+)"')
+
+# Regex approximation of word_tokenize: keeps hyphenated and dotted words
+# together and splits "n't"/"cannot" the way the Treebank tokenizer does.
+FAST_TOKEN_RE = re.compile(r"\bcan(?=not\b)|\w+(?=n't)|n't|\w+(?:[-.]\w+)*")
 
 
 class IREngine:
-    def __init__(self, processed_data_folder):
+    def __init__(self, processed_data_folder, fast_tokenizer=False, progress=None, compress_docs=True,
+                 scoring_backend="postings", ranking_model="tfidf", early_termination=True, positional=False):
+        if scoring_backend not in SCORING_BACKENDS:
+            raise ValueError(f"Unknown scoring backend {scoring_backend!r}, expected one of {SCORING_BACKENDS}")
+        if ranking_model not in RANKING_MODELS:
+            raise ValueError(f"Unknown ranking model {ranking_model!r}, expected one of {RANKING_MODELS}")
+
         self.processed_data_folder = processed_data_folder
+        self.fast_tokenizer = fast_tokenizer
+        self.compress_docs = compress_docs
+        self.scoring_backend = scoring_backend
+        self.ranking_model = ranking_model
+        self.early_termination = early_termination
+        # Keep token positions for phrase queries and proximity ranking.
+        self.positional = positional
+        # Optional progress(stage, done, total) callback, e.g. for EngineLoader.
+        self.progress = progress
 
-        self.inverted_index_file = os.path.join(self.processed_data_folder, 'inverted_index.json')
-        self.doc_vectors_file = os.path.join(self.processed_data_folder, 'doc_vectors.json')
+        self.index_file = os.path.join(self.processed_data_folder, 'index.bin')
+        self.doc_store_file = os.path.join(self.processed_data_folder, 'corpus.bin')
 
         self.stopwords = set(stopwords.words("english"))
         self.lemmatizer = WordNetLemmatizer()
         self.stemmer = PorterStemmer()
+        self._normalize_token = lru_cache(maxsize=TOKEN_CACHE_SIZE)(self._normalize_token_uncached)
+        # Token -> occurrences in the documents indexed since the last save;
+        # picks the word suggestions show for each term.
+        self._surface_counts = defaultdict(int)
+        # Postings of the last saved index, whose display words carry over
+        # to an update.
+        self._saved_terms = None
 
-        self.docs = []
+        self.doc_store = None
         self.doc_filenames = []
+        self.manifest = []
+        self.index_version = None
         self.N = 0
+        self._doc_ids = {}
 
         self.inverted_index = defaultdict(list)
+        self.term_df = {}
         self.doc_lengths = {}
-        self.doc_vectors = {}
+        self.doc_norms = []
+        self.doc_paragraphs = []
+        self.avgdl = 0.0
+        self.bm25 = None
+        # term -> encoded positions per posting, aligned with inverted_index.
+        self.positions = None
+        self.sources = None
+        self.spelling = None
+
+        # Term x doc matrix of normalized TF-IDF weights for batch scoring,
+        # built on first use and dropped whenever the index changes.
+        self._matrix = None
+        self._matrix_vocab = None
+        self._matrix_lock = threading.Lock()
 
         self._initialize_ir_assets()
 
     def _initialize_ir_assets(self):
-        self.docs, self.doc_filenames = self._load_processed_documents()
-        self.N = len(self.docs)
+        if os.path.exists(self.index_file) and self._load_index():
+            print("IR assets loaded successfully.")
+            self.update_index()
+            return
 
-        if not self.docs:
+        self._build_from_scratch()
+
+    def _build_from_scratch(self):
+        self.doc_filenames = []
+        self.manifest = []
+
+        found = self._scan_processed_files()
+        writer = doc_store.DocumentWriter(self.compress_docs)
+
+        # Files are read, indexed and packed one at a time, so only one
+        # document's text is held in memory during the build.
+        def read_documents():
+            for i, (path, st) in enumerate(found):
+                self._report("indexing", i, len(found))
+                try:
+                    text, digest = self._read_document(path)
+                except Exception as e:
+                    print(f"Error reading processed file {path}: {e}")
+                    continue
+                writer.append(text)
+                self.doc_filenames.append(path)
+                self.manifest.append(self._manifest_entry(path, st, digest))
+                yield text
+
+        if not found:
             print(f"WARNING: No processed documents in {self.processed_data_folder}")
             return
 
-        if os.path.exists(self.inverted_index_file) and os.path.exists(self.doc_vectors_file):
-            self._load_index_and_vectors()
-            print("IR assets loaded successfully.")
-        else:
-            print("Building IR assets from scratch…")
-            self.build_index()
-            self.build_tfidf_vectors()
-            self._save_index_and_vectors()
+        print("Building IR assets from scratch…")
+        self.build_index(read_documents())
+        self.N = len(self.doc_filenames)
+        self.build_tfidf_vectors()
+        self._save_index(writer)
 
-    def _load_processed_documents(self):
-        all_text = []
-        all_filenames = []
+    def _report(self, stage, done, total):
+        if self.progress is not None:
+            self.progress(stage, done, total)
 
+    def _scan_processed_files(self):
+        found = []
         for root, dirs, files in os.walk(self.processed_data_folder):
             for file in files:
                 if file.lower().endswith(".txt"):
                     path = os.path.join(root, file)
-                    try:
-                        with open(path, "r", encoding="utf-8") as f:
-                            all_text.append(f.read())
-                            all_filenames.append(path)
-                        #print(f"DEBUG: Loaded processed file {path}")
-                    except Exception as e:
-                        print(f"Error reading processed file {file}: {e}")
+                    found.append((path, os.stat(path)))
+        return found
 
-        return all_text, all_filenames
+    def _read_document(self, path):
+        with open(path, "rb") as f:
+            raw = f.read()
+        return strip_source_tag(raw.decode("utf-8")), hashlib.sha1(raw).hexdigest()
 
-    def _save_index_and_vectors(self):
-        try:
-            with open(self.inverted_index_file, 'w', encoding='utf-8') as f:
-                json.dump(self.inverted_index, f)
+    def _manifest_entry(self, path, st, digest):
+        rel = os.path.relpath(path, self.processed_data_folder)
+        return {
+            "path": rel,
+            "source": source_label_for(rel),
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "sha1": digest,
+        }
+
+    def _detect_changes(self):
+        """Compares the processed_data folder with the manifest saved with the index."""
+        indexed = {entry["path"]: entry for entry in self.manifest}
+        seen = set()
+        added, modified, touched = [], [], []
+
+        for path, st in self._scan_processed_files():
+            rel = os.path.relpath(path, self.processed_data_folder)
+            seen.add(rel)
+            entry = indexed.get(rel)
+
+            if entry is None:
+                added.append(path)
+            elif entry["size"] != st.st_size or entry["mtime"] != st.st_mtime_ns:
+                # Only hash files whose stat changed; same content just refreshes the stat.
+                try:
+                    _, digest = self._read_document(path)
+                except Exception as e:
+                    print(f"Error reading processed file {path}: {e}")
+                    continue
+                if digest == entry["sha1"]:
+                    touched.append((rel, st))
+                else:
+                    modified.append(path)
+
+        removed = [rel for rel in indexed if rel not in seen]
+        return added, modified, removed, touched
 
-            serializable_vectors = {str(k): v for k, v in self.doc_vectors.items()}
-            with open(self.doc_vectors_file, 'w', encoding='utf-8') as f:
-                json.dump(serializable_vectors, f)
+    def update_index(self):
+        """Re-indexes only the processed files that were added, changed or deleted."""
+        added, modified, removed, touched = self._detect_changes()
+
+        entries = {entry["path"]: entry for entry in self.manifest}
+        for rel, st in touched:
+            entries[rel]["size"], entries[rel]["mtime"] = st.st_size, st.st_mtime_ns
+
+        if not (added or modified or removed):
+            if touched:
+                # Only the stored stats are stale; the loaded index stays
+                # valid if they cannot be written.
+                try:
+                    self._save_index()
+                except RuntimeError as e:
+                    print(f"{e}; serving the existing index.")
+            return {"added": [], "modified": [], "removed": []}
+
+        print(f"Updating IR assets: {len(added)} added, {len(modified)} modified, {len(removed)} removed…")
+
+        dropped = set(removed) | {os.path.relpath(p, self.processed_data_folder) for p in modified}
+
+        remap = {}
+        writer = doc_store.DocumentWriter(self.compress_docs)
+        filenames, manifest, doc_lengths, doc_paragraphs = [], [], {}, []
+        for old_id, entry in enumerate(self.manifest):
+            if entry["path"] in dropped:
+                continue
+            new_id = len(filenames)
+            remap[old_id] = new_id
+            writer.copy_from(self.doc_store, old_id)
+            filenames.append(self.doc_filenames[old_id])
+            manifest.append(entry)
+            doc_paragraphs.append(self.doc_paragraphs[old_id])
+            doc_lengths[new_id] = self.doc_lengths[old_id]
+
+        inverted_index = defaultdict(list)
+        positions = defaultdict(list) if self.positional else None
+        for term, postings in self.inverted_index.items():
+            kept = [(remap[doc_id], freq) for doc_id, freq in postings if doc_id in remap]
+            if kept:
+                inverted_index[term] = kept
+                if self.positional:
+                    positions[term] = [data for (doc_id, _), data in zip(postings, self.positions[term])
+                                       if doc_id in remap]
+
+        self.inverted_index = inverted_index
+        self.positions = positions
+        self.doc_lengths = doc_lengths
+        self.doc_paragraphs = doc_paragraphs
+        self.doc_filenames, self.manifest = filenames, manifest
+
+        changed = modified + added
+        for i, path in enumerate(changed):
+            self._report("indexing", i, len(changed))
+            try:
+                text, digest = self._read_document(path)
+            except Exception as e:
+                print(f"Error reading processed file {path}: {e}")
+                continue
+            self._index_document(len(self.doc_filenames), text)
+            writer.append(text)
+            self.doc_filenames.append(path)
+            self.manifest.append(self._manifest_entry(path, os.stat(path), digest))
+
+        self.N = len(self.doc_filenames)
+        self.term_df = {t: len(p) for t, p in self.inverted_index.items()}
+
+        # IDF depends on N and df, so every norm moves; this is a pass over the
+        # postings only, no document is re-tokenized.
+        self.build_tfidf_vectors()
+        self._save_index(writer)
+
+        return {
+            "added": [os.path.relpath(p, self.processed_data_folder) for p in added],
+            "modified": [os.path.relpath(p, self.processed_data_folder) for p in modified],
+            "removed": removed,
+        }
+
+    def _compute_index_version(self):
+        """Content hash of the indexed corpus; changes on every rebuild or update that alters it."""
+        key = f"{index_store.FORMAT_VERSION}:{self._tokenizer_name()}"
+        if self.positional:
+            # Proximity changes rankings, so cached results must not carry over.
+            key += ":positions"
+        digest = hashlib.sha1(key.encode("utf-8"))
+        for entry in self.manifest:
+            digest.update(f"{entry['path']}:{entry['sha1']};".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _save_index(self, writer=None):
+        """Writes index.bin, plus corpus.bin when the documents changed, and reloads both.
+
+        Searching needs the reloaded files (BM25 impacts, sources, spelling,
+        the document store), so a failed write or reload raises RuntimeError
+        instead of leaving a half-initialized engine.
+        """
+        self._report("saving", 0, 1)
+        self.index_version = self._compute_index_version()
+
+        try:
+            if writer is not None:
+                writer.write(self.doc_store_file, self.index_version)
+            sections = index_store.build_term_sections(self.inverted_index, self._display_words())
+            self._surface_counts = defaultdict(int)
+            sections.update(index_store.build_spelling_sections(sections))
+            sections["norms"] = array("d", self.doc_norms)
+            sections["doclen"] = array("I", (self.doc_lengths[doc_id] for doc_id in range(self.N)))
+            bm25_sections, avgdl = self._build_bm25_sections()
+            sections.update(bm25_sections)
+            sections.update(index_store.build_paragraph_sections(self.doc_paragraphs, self.inverted_index))
+            if self.positional:
+                sections.update(index_store.build_position_sections(self.positions))
+            labels, source_sections = index_store.build_source_sections([e["source"] for e in self.manifest])
+            sections.update(source_sections)
+            meta = {
+                "N": self.N,
+                "avgdl": avgdl,
+                "bm25": {"k1": BM25_K1, "b": BM25_B},
+                "positional": self.positional,
+                "sources": labels,
+                "version": self.index_version,
+                "tokenizer": self._tokenizer_name(),
+                "manifest": self.manifest,
+            }
+            index_store.write_index(self.index_file, meta, sections)
             print("IR assets saved successfully.")
         except Exception as e:
-            print(f"Saving IR assets failed: {e}")
+            raise RuntimeError(f"Saving IR assets failed: {e}") from e
 
-    def _load_index_and_vectors(self):
-        try:
-            with open(self.inverted_index_file, 'r', encoding='utf-8') as f:
-                self.inverted_index = defaultdict(list, json.load(f))
+        if not self._load_index():
+            raise RuntimeError("Reloading the saved IR assets failed")
 
-            with open(self.doc_vectors_file, 'r', encoding='utf-8') as f:
-                vecs = json.load(f)
-                self.doc_vectors = {int(k): v for k, v in vecs.items()}
+    def _load_index(self):
+        try:
+            index = index_store.MappedIndex(self.index_file)
+            manifest = index.meta["manifest"]
+            version = index.meta["version"]
         except Exception as e:
             print(f"Error loading IR assets, rebuilding required: {e}")
-            self.inverted_index = defaultdict(list)
-            self.doc_vectors = {}
+            return False
+
+        if index.meta.get("tokenizer", "nltk") != self._tokenizer_name():
+            print("Index was built with a different tokenizer, rebuilding required.")
+            return False
+
+        if index.meta.get("bm25") != {"k1": BM25_K1, "b": BM25_B}:
+            print("Index was built with different BM25 parameters, rebuilding required.")
+            return False
+
+        if index.meta.get("positional", False) != self.positional:
+            print("Index positions do not match the positional setting, rebuilding required.")
+            return False
 
-    def preprocess(self, text):
+        try:
+            store = doc_store.DocumentStore(self.doc_store_file)
+        except Exception as e:
+            print(f"Error loading document store, rebuilding required: {e}")
+            return False
+
+        if store.meta.get("version") != version or len(store) != index.meta["N"]:
+            print("Document store does not match the index, rebuilding required.")
+            return False
+
+        self.doc_store = store
+        self.manifest = manifest
+        self.index_version = version
+        self.doc_filenames = [os.path.join(self.processed_data_folder, e["path"]) for e in manifest]
+        self.N = index.meta["N"]
+        self.inverted_index = index.postings
+        self._saved_terms = index.postings
+        self.term_df = index.postings.df
+        self.doc_norms = index.norms
+        self.doc_lengths = index.doc_lengths
+        self.avgdl = index.meta["avgdl"]
+        self.bm25 = index.impacts
+        self.positions = index.positions
+        self.sources = index.sources
+        self.spelling = index.spelling
+        self.doc_paragraphs = index.paragraphs
+        self._matrix = None
+
+        self._doc_ids = {}
+        for doc_id, (entry, path) in enumerate(zip(manifest, self.doc_filenames)):
+            self._doc_ids[entry["path"]] = doc_id
+            self._doc_ids[path] = doc_id
+        return True
+
+    def get_document_text(self, key):
+        """Full text of a document, by doc ID or by its path (absolute or relative
+        to the processed data folder). Returns None for unknown documents."""
+        doc_id = key if isinstance(key, int) else self._doc_ids.get(key)
+        if doc_id is None or self.doc_store is None or not 0 <= doc_id < len(self.doc_store):
+            return None
+        return self.doc_store[doc_id]
+
+    def _normalize_token_uncached(self, tok):
+        tok = NON_ALNUM_RE.sub("", tok)
+        if not tok or tok in self.stopwords:
+            return None
+        tok = self.lemmatizer.lemmatize(tok)
+        return self.stemmer.stem(tok)
+
+    def _display_words(self):
+        """term -> word shown for it in suggestions ("binary" for "binari"): the
+        one in the last saved index, else its most frequent token since then."""
+        counts = defaultdict(int)
+        for tok, n in self._surface_counts.items():
+            counts[self._normalize_token(tok), NON_ALNUM_RE.sub("", tok)] += n
+
+        best = {}
+        for (term, word), n in counts.items():
+            if term not in best or n > best[term][1]:
+                best[term] = (word, n)
+        words = {term: word for term, (word, _) in best.items()}
+
+        if self._saved_terms is not None:
+            for term_id in range(len(self._saved_terms)):
+                term = self._saved_terms.term(term_id)
+                if term in self.inverted_index:
+                    words[term] = self._saved_terms.word(term_id)
+        return words
+
+    def vocabulary(self):
+        """(display word, document frequency) of every indexed term."""
+        return self.inverted_index.vocabulary()
+
+    def _tokenizer_name(self):
+        return "fast" if self.fast_tokenizer else "nltk"
+
+    def tokenize(self, text, fast=None):
+        if fast is None:
+            fast = self.fast_tokenizer
+        if fast:
+            return FAST_TOKEN_RE.findall(text)
+        return word_tokenize(text)
+
+    def preprocess(self, text, fast=None):
         text = text.lower()
-        tokens = word_tokenize(text)
 
         cleaned = []
-        for tok in tokens:
-            tok = re.sub(r"[^a-z0-9]", "", tok)
-            if not tok:
-                continue
-            if tok in self.stopwords:
-                continue
-            tok = self.lemmatizer.lemmatize(tok)
-            tok = self.stemmer.stem(tok)
-            cleaned.append(tok)
+        for tok in self.tokenize(text, fast):
+            tok = self._normalize_token(tok)
+            if tok:
+                cleaned.append(tok)
 
         return cleaned
 
-    def build_index(self):
-        self.inverted_index = defaultdict(list)
-        self.doc_lengths = {}
+    def preprocess_positions(self, text, fast=None):
+        """preprocess() as (position, term) pairs; positions count every token,
+        so dropped stopwords and punctuation still leave a gap."""
+        return self._positioned_terms(self.tokenize(text.lower(), fast))
+
+    def _positioned_terms(self, tokens):
+        positioned = []
+        for pos, tok in enumerate(tokens):
+            tok = self._normalize_token(tok)
+            if tok:
+                positioned.append((pos, tok))
+        return positioned
+
+    def correct_query(self, query):
+        """query with every word that matches no indexed term replaced by the
+        closest indexed word, or None when there is nothing to correct."""
+        corrected = False
+
+        def correct_word(match):
+            nonlocal corrected
+            word = match.group(0).lower()
+            if len(word) < spelling.MIN_WORD_LENGTH:
+                return match.group(0)
+            term = self._normalize_token(word)
+            if term is None or term in self.inverted_index:
+                return match.group(0)
+
+            correction = self.spelling.correct(word)
+            if correction is None:
+                return match.group(0)
+            corrected = True
+            return correction
+
+        text = spelling.WORD_RE.sub(correct_word, query)
+        if not corrected:
+            return None
+        METRICS.inc("search_corrections_total")
+        return text
+
+    def parse_query(self, query):
+        """Returns (q_tokens, phrases). Every quoted part of the query becomes a
+        phrase: a tuple of (offset, term) pairs, offsets relative to its first term."""
+        phrases = []
+        for text in PHRASE_RE.findall(query):
+            positioned = self.preprocess_positions(text)
+            if positioned:
+                first = positioned[0][0]
+                phrases.append(tuple((pos - first, term) for pos, term in positioned))
+        return self.preprocess(query), phrases
 
-        for doc_id, text in enumerate(self.docs):
-            tokens = self.preprocess(text)
+    def _index_document(self, doc_id, text):
+        tokens = self.tokenize(text.lower())
+        # Normalizing each distinct token once per document is also what
+        # feeds the per-token counts behind _display_words.
+        token_counts = Counter(tokens)
+        surface_counts = self._surface_counts
 
+        if self.positional:
+            term_positions = defaultdict(list)
+            for pos, t in self._positioned_terms(tokens):
+                term_positions[t].append(pos)
+            tf = {t: len(p) for t, p in term_positions.items()}
+            for term, positions in term_positions.items():
+                self.positions[term].append(index_store.encode_positions(positions))
+            for tok, n in token_counts.items():
+                if self._normalize_token(tok):
+                    surface_counts[tok] += n
+        else:
             tf = defaultdict(int)
-            for t in tokens:
-                tf[t] += 1
+            for tok, n in token_counts.items():
+                t = self._normalize_token(tok)
+                if t:
+                    tf[t] += n
+                    surface_counts[tok] += n
+
+        self.doc_lengths[doc_id] = sum(tf.values())
+
+        for term, freq in tf.items():
+            self.inverted_index[term].append((doc_id, freq))
+
+        self.doc_paragraphs.append(self.index_paragraphs(text))
 
-            self.doc_lengths[doc_id] = len(tokens)
+    def build_index(self, texts):
+        self.inverted_index = defaultdict(list)
+        self.positions = defaultdict(list) if self.positional else None
+        self.doc_lengths = {}
+        self.doc_paragraphs = []
+
+        for doc_id, text in enumerate(texts):
+            self._index_document(doc_id, text)
 
-            for term, freq in tf.items():
-                self.inverted_index[term].append((doc_id, freq))
+        self.term_df = {t: len(p) for t, p in self.inverted_index.items()}
 
         print("Inverted index built.")
 
+    def bm25_idf(self, df):
+        # Lucene's variant: never negative, even for terms in most documents.
+        return math.log(1 + (self.N - df + 0.5) / (df + 0.5))
+
+    def _build_bm25_sections(self):
+        """Precomputes every posting's BM25 impact, in doc and in impact order."""
+        lengths = np.array([self.doc_lengths[doc_id] for doc_id in range(self.N)], dtype=np.float64)
+        avgdl = float(lengths.mean()) if self.N else 0.0
+        if avgdl > 0:
+            length_norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avgdl)
+        else:
+            length_norm = np.full(self.N, BM25_K1)
+
+        by_doc, by_doc_impacts, by_impact, sorted_impacts = [], [], [], []
+        # Term ID order, the same order build_term_sections writes.
+        for term, postings in sorted(self.inverted_index.items()):
+            docs = np.fromiter((doc_id for doc_id, _ in postings), dtype=np.uint32, count=len(postings))
+            freqs = np.fromiter((freq for _, freq in postings), dtype=np.float64, count=len(postings))
+            impacts = self.bm25_idf(len(postings)) * freqs * (BM25_K1 + 1) / (freqs + length_norm[docs])
+            impacts = impacts.astype(np.float32)
+
+            order = np.lexsort((docs, -impacts))
+            by_doc.append(docs)
+            by_doc_impacts.append(impacts)
+            by_impact.append(docs[order])
+            sorted_impacts.append(impacts[order])
+
+        def join(parts, dtype):
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+        sections = {
+            "bm25doc": join(by_doc, np.uint32),
+            "bm25imp": join(by_doc_impacts, np.float32),
+            "impdoc": join(by_impact, np.uint32),
+            "impact": join(sorted_impacts, np.float32),
+        }
+        return sections, avgdl
+
     def compute_idf(self, term):
-        df = len(self.inverted_index.get(term, []))
+        df = self.term_df.get(term, 0)
         if df == 0:
             return 0
         return math.log(self.N / df)
 
     def build_tfidf_vectors(self):
-        self.doc_vectors = {}
-
-        idf_cache = {t: self.compute_idf(t) for t in self.inverted_index}
-
-        for doc_id in range(self.N):
-            vec = {}
-            term_freqs = defaultdict(int)
+        self._matrix = None
+        squared = [0] * self.N
 
-            for term, postings in self.inverted_index.items():
-                for p_doc, freq in postings:
-                    if p_doc == doc_id:
-                        term_freqs[term] = freq
+        for term, postings in self.inverted_index.items():
+            idf = self.compute_idf(term)
+            for doc_id, freq in postings:
+                weight = freq * idf
+                squared[doc_id] += weight * weight
 
-            for term, freq in term_freqs.items():
-                vec[term] = freq * idf_cache.get(term, 0)
-
-            length = math.sqrt(sum(v * v for v in vec.values()))
-            if length > 0:
-                vec = {t: v / length for t, v in vec.items()}
-
-            self.doc_vectors[doc_id] = vec
+        self.doc_norms = [math.sqrt(s) for s in squared]
 
         print("TF-IDF vectors built.")
 
@@ -163,14 +615,10 @@ class IREngine:
         text = re.sub(r'\s+', ' ', text)
         return text.strip()
 
-    def get_best_paragraph(self, full_text, query_tokens):
-        paragraphs = re.split(r"\n\s*\n", full_text)
-        best_score = -1
-        best_para = ""
-
-        query_set = set(query_tokens)
+    def index_paragraphs(self, full_text):
+        paragraphs = []
 
-        for p in paragraphs:
+        for p in re.split(r"\n\s*\n", full_text):
             p = self.clean_paragraph(p)
             if not p:
                 continue
@@ -183,10 +631,21 @@ class IREngine:
             for t in tokens:
                 tf[t] += 1
 
+            paragraphs.append((p, dict(tf)))
+
+        return paragraphs
+
+    def select_paragraph(self, paragraphs, query_tokens):
+        best_score = -1
+        best_para = ""
+
+        idf = {t: self.compute_idf(t) for t in set(query_tokens)}
+
+        for p, tf in paragraphs:
             score = 0
-            for t in query_set:
+            for t, t_idf in idf.items():
                 if t in tf:
-                    score += tf[t] * self.compute_idf(t)
+                    score += tf[t] * t_idf
 
             if score > best_score:
                 best_score = score
@@ -194,14 +653,53 @@ class IREngine:
 
         return best_para
 
+    def get_best_paragraph(self, full_text, query_tokens):
+        return self.select_paragraph(self.index_paragraphs(full_text), query_tokens)
+
+    def best_paragraph(self, doc_id, query_tokens):
+        return self.select_paragraph(self.doc_paragraphs[doc_id], query_tokens)
+
     def cosine_sim(self, v1, v2):
         return sum(v1.get(t, 0) * v2.get(t, 0) for t in v1)
 
-    def search(self, query):
-        q_tokens = self.preprocess(query)
-        if not q_tokens:
-            return []
+    def score_documents(self, q_vec):
+        scores = defaultdict(float)
+        touched = 0
 
+        for t, q_weight in q_vec.items():
+            idf = self.compute_idf(t)
+            postings = self.inverted_index.get(t, [])
+            touched += len(postings)
+            for doc_id, freq in postings:
+                weight = freq * idf
+                norm = self.doc_norms[doc_id]
+                if norm > 0:
+                    weight = weight / norm
+                scores[doc_id] += q_weight * weight
+
+        METRICS.inc("search_postings_touched_total", touched)
+        METRICS.inc("search_documents_scored_total", len(scores))
+        return scores
+
+    def top_k(self, scores, k):
+        matched = ((doc_id, score) for doc_id, score in scores.items() if score > 0)
+        top = heapq.nlargest(k, matched, key=lambda x: (x[1], -x[0]))
+
+        # Pad with zero-score documents (lowest doc_id first) so the result
+        # list is the same as ranking every document in the corpus.
+        doc_id = 0
+        while len(top) < k and doc_id < self.N:
+            if scores.get(doc_id, 0) <= 0:
+                top.append((doc_id, 0.0))
+            doc_id += 1
+
+        return top
+
+    def rank(self, query, top_k=TOP_K, model=None):
+        q_tokens, phrases = self.parse_query(query)
+        return q_tokens, self.rank_tokens(q_tokens, top_k, model, phrases)
+
+    def query_vector(self, q_tokens):
         q_tf = defaultdict(int)
         for t in q_tokens:
             q_tf[t] += 1
@@ -214,25 +712,417 @@ class IREngine:
         if q_len > 0:
             q_vec = {t: v / q_len for t, v in q_vec.items()}
 
-        scores = []
-        for doc_id in range(self.N):
-            sim = self.cosine_sim(q_vec, self.doc_vectors.get(doc_id, {}))
-            scores.append((doc_id, sim))
+        return q_vec
+
+    def rank_tokens(self, q_tokens, top_k=TOP_K, model=None, phrases=None, sources=None):
+        """Top-k (doc_id, score) pairs, optionally only from the given source
+        labels. Phrases, from parse_query, only take effect with a positional
+        index; so does the proximity rerank."""
+        if not q_tokens:
+            return []
+
+        if sources or (self.positional and phrases):
+            return self._rank_filtered(q_tokens, top_k, model, phrases, sources)
+
+        if self.positional and len(set(q_tokens)) > 1:
+            ranked = self._rank_tokens(q_tokens, max(top_k, PROXIMITY_CANDIDATES), model)
+            return self._proximity_rerank(ranked, q_tokens)[:top_k]
+
+        return self._rank_tokens(q_tokens, top_k, model)
+
+    def _rank_tokens(self, q_tokens, top_k, model):
+        if (model or self.ranking_model) == "bm25":
+            return self.rank_bm25(q_tokens, top_k)
+
+        if self.scoring_backend == "csr":
+            scores = self.score_queries([q_tokens])
+            return self._top_k_sparse(scores.indices, scores.data, top_k)
+
+        scores = self.score_documents(self.query_vector(q_tokens))
+        return self.top_k(scores, top_k)
+
+    def term_doc_matrix(self):
+        """Returns (matrix, vocab): the V x N CSR matrix of freq * idf / norm weights
+        and a term -> row mapping. Built from the postings on first use."""
+        with self._matrix_lock:
+            if self._matrix is None:
+                self._matrix, self._matrix_vocab = self._build_term_doc_matrix()
+            return self._matrix, self._matrix_vocab
+
+    def _build_term_doc_matrix(self):
+        norms = np.asarray(self.doc_norms, dtype=np.float64)
+        # Same arithmetic as score_documents: zero-length documents are not divided.
+        norms = np.where(norms > 0, norms, 1.0)
+
+        vocab = {}
+        indptr = [0]
+        indices = []
+        data = []
+        for term, postings in self.inverted_index.items():
+            vocab[term] = len(vocab)
+            if postings:
+                doc_ids, freqs = zip(*postings)
+                doc_ids = np.array(doc_ids, dtype=np.int64)
+                # compute_idf without a second term lookup: df is the postings length.
+                weights = np.array(freqs, dtype=np.float64) * math.log(self.N / len(postings))
+                indices.append(doc_ids)
+                data.append(weights / norms[doc_ids])
+            indptr.append(indptr[-1] + len(postings))
+
+        matrix = csr_matrix(
+            (np.concatenate(data) if data else np.zeros(0),
+             np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64),
+             np.array(indptr, dtype=np.int64)),
+            shape=(len(vocab), self.N),
+        )
+        return matrix, vocab
+
+    def rank_many(self, queries, top_k=TOP_K, model=None):
+        """Ranks every query in one sparse product; same results as rank() per query.
+
+        Returns (token lists, rankings) in query order. BM25 batches are ranked
+        query by query, each already a handful of vectorized impact sums, and so
+        are batches on a positional index, which reads positions per query.
+        """
+        # Batches repeat queries often (topic lists); tokenize each one once.
+        tokenized = {}
+        parsed = []
+        for q in queries:
+            if q not in tokenized:
+                tokenized[q] = self.parse_query(q)
+            parsed.append(tokenized[q])
+        token_lists = [q_tokens for q_tokens, _ in parsed]
+
+        if (model or self.ranking_model) == "bm25" or self.positional:
+            return token_lists, [self.rank_tokens(q_tokens, top_k, model, phrases) for q_tokens, phrases in parsed]
+
+        scores = self.score_queries(token_lists)
+
+        rankings = []
+        for i, q_tokens in enumerate(token_lists):
+            if not q_tokens:
+                rankings.append([])
+                continue
+            start, end = scores.indptr[i], scores.indptr[i + 1]
+            rankings.append(self._top_k_sparse(scores.indices[start:end], scores.data[start:end], top_k))
+
+        return token_lists, rankings
+
+    def score_queries(self, token_lists):
+        """Scores of every query against every document as a queries x N CSR matrix."""
+        matrix, vocab = self.term_doc_matrix()
+
+        rows, cols, vals = [], [], []
+        touched = 0
+        for i, q_tokens in enumerate(token_lists):
+            for t, weight in self.query_vector(q_tokens).items():
+                term_row = vocab.get(t)
+                if term_row is not None:
+                    rows.append(i)
+                    cols.append(term_row)
+                    vals.append(weight)
+                    touched += matrix.indptr[term_row + 1] - matrix.indptr[term_row]
+
+        q_matrix = csr_matrix((vals, (rows, cols)), shape=(len(token_lists), matrix.shape[0]))
+        scores = (q_matrix @ matrix).tocsr()
+
+        METRICS.inc("search_postings_touched_total", int(touched))
+        METRICS.inc("search_documents_scored_total", scores.nnz)
+        return scores
+
+    def _top_k_sparse(self, doc_ids, values, k, pad=True):
+        positive = values > 0
+        doc_ids, values = doc_ids[positive], values[positive]
+
+        if len(values) > k:
+            # argpartition finds the k-th best score; everything tied with it
+            # is kept so the exact (score, doc_id) order below decides.
+            kth = values[np.argpartition(-values, k - 1)[:k]].min()
+            keep = values >= kth
+            doc_ids, values = doc_ids[keep], values[keep]
+
+        order = np.lexsort((doc_ids, -values))[:k]
+        top = list(zip(doc_ids[order].tolist(), values[order].tolist()))
+
+        # Fewer than k matches: pad like top_k so results equal rank().
+        if pad and len(top) < k:
+            matched = set(doc_ids.tolist())
+            doc_id = 0
+            while len(top) < k and doc_id < self.N:
+                if doc_id not in matched:
+                    top.append((doc_id, 0.0))
+                doc_id += 1
+
+        return top
 
-        scores.sort(key=lambda x: x[1], reverse=True)
+    def _bm25_terms(self, q_tokens):
+        if self.bm25 is None:
+            raise ValueError("BM25 ranking needs a saved index")
 
-        TOP_K = 50
+        q_tf = defaultdict(int)
+        for t in q_tokens:
+            q_tf[t] += 1
+
+        terms = []
+        for t, qtf in q_tf.items():
+            term_id = self.inverted_index.term_id(t)
+            if term_id >= 0:
+                terms.append((term_id, float(qtf)))
+        return terms
+
+    def rank_bm25(self, q_tokens, top_k=TOP_K):
+        terms = self._bm25_terms(q_tokens)
+        if self.early_termination:
+            doc_ids, scores = self._bm25_threshold(terms, top_k)
+        else:
+            doc_ids, scores = self._bm25_exhaustive(terms)
+
+        return self._top_k_sparse(doc_ids, scores, top_k)
+
+    def _bm25_exhaustive(self, terms):
+        scores = np.zeros(self.N)
+        touched = 0
+        for term_id, qtf in terms:
+            docs, impacts = self.bm25.by_doc(term_id)
+            scores[docs] += impacts.astype(np.float64) * qtf
+            touched += len(docs)
+
+        doc_ids = np.flatnonzero(scores > 0)
+        METRICS.inc("search_postings_touched_total", touched)
+        METRICS.inc("search_documents_scored_total", len(doc_ids))
+        return doc_ids, scores[doc_ids]
+
+    def _bm25_threshold(self, terms, k):
+        """Top-k candidates from the heads of the impact-ordered postings.
+
+        Each of a term's k highest-impact documents scores at least that term's
+        k-th impact, which bounds the k-th best score from below. Reading every
+        list down to a depth where the impacts left add up to less than that
+        bound, and scoring those documents exactly, gives the same top k as
+        scoring every posting. When that depth would cover more than
+        BM25_MAX_HEAD_FRACTION of the postings, they are all scored instead.
+        """
+        lists = [(self.bm25.by_impact(term_id), self.bm25.by_doc(term_id), qtf) for term_id, qtf in terms]
+        total = sum(len(docs) for (docs, _), _, _ in lists)
+        longest = max((len(docs) for (docs, _), _, _ in lists), default=0)
+
+        floor = max((float(impacts[k - 1]) * qtf for (_, impacts), _, qtf in lists if len(impacts) >= k),
+                    default=0.0)
+        depth = max(BM25_BLOCK_SIZE, k)
+        while depth < longest:
+            ceiling = sum(float(impacts[depth]) * qtf for (_, impacts), _, qtf in lists if depth < len(impacts))
+            if ceiling < floor:
+                break
+            depth *= 2
+
+        touched = sum(min(depth, len(docs)) for (docs, _), _, _ in lists)
+        if touched > total * BM25_MAX_HEAD_FRACTION:
+            return self._bm25_exhaustive(terms)
+        if not lists:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        doc_ids = np.unique(np.concatenate([docs[:depth] for (docs, _), _, _ in lists]))
+        scores = np.zeros(len(doc_ids))
+        # Terms are added in query order, as in _bm25_exhaustive, so both
+        # paths produce bit-identical scores.
+        for _, (docs, impacts), qtf in lists:
+            pos = np.minimum(np.searchsorted(docs, doc_ids), len(docs) - 1)
+            hit = docs[pos] == doc_ids
+            scores[hit] += impacts[pos[hit]].astype(np.float64) * qtf
+
+        METRICS.inc("search_postings_touched_total", touched)
+        METRICS.inc("search_documents_scored_total", len(doc_ids))
+        return doc_ids, scores
+
+    def _score_all(self, q_tokens, model):
+        """(doc_ids, scores) of every document with a positive score."""
+        if (model or self.ranking_model) == "bm25":
+            return self._bm25_exhaustive(self._bm25_terms(q_tokens))
+
+        if self.scoring_backend == "csr":
+            scores = self.score_queries([q_tokens])
+            doc_ids, values = scores.indices, scores.data
+        else:
+            scores = self.score_documents(self.query_vector(q_tokens))
+            doc_ids = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+            values = np.fromiter(scores.values(), dtype=np.float64, count=len(scores))
+
+        positive = values > 0
+        return doc_ids[positive], values[positive]
+
+    def rank_with_facets(self, q_tokens, top_k=TOP_K, model=None, phrases=None, sources=None):
+        """Returns (ranking, facets).
+
+        facets maps every source label to its number of matching documents,
+        counted from the postings before the sources filter is applied, so the
+        counts of the other sources stay visible. Without a sources filter the
+        ranking is rank_tokens' own, heap top-k and BM25 early termination
+        included; filtering by source scores every matching document instead.
+        """
+        if not q_tokens:
+            return [], dict.fromkeys(self.sources.labels, 0)
+
+        facets = self.sources.counts(self.matching_docs(q_tokens, model, phrases))
+        return self.rank_tokens(q_tokens, top_k, model, phrases, sources), facets
+
+    def matching_docs(self, q_tokens, model=None, phrases=None):
+        """Sorted doc IDs with a positive score for the query (and, with a
+        positional index, containing every phrase), from the postings alone."""
+        bm25 = (model or self.ranking_model) == "bm25"
+        # A mask over all documents is cheaper than sorting the concatenated
+        # postings to deduplicate them.
+        mask = np.zeros(self.N, dtype=bool)
+        for t in set(q_tokens):
+            term_id = self.inverted_index.term_id(t)
+            # TF-IDF gives terms found in every document no weight.
+            if term_id >= 0 and (bm25 or self.compute_idf(t) > 0):
+                mask[self.bm25.by_doc(term_id)[0]] = True
+        matched = np.flatnonzero(mask)
 
+        if self.positional and phrases and len(matched):
+            matched = np.intersect1d(matched, self.phrase_matches(phrases), assume_unique=True)
+        return matched
+
+    def _rank_filtered(self, q_tokens, top_k, model, phrases, sources):
+        """Scores every matching document, then keeps those containing every
+        phrase and from the given sources. Unlike rank_tokens, the ranking is
+        not padded with non-matching documents."""
+        doc_ids, scores = self._score_all(q_tokens, model)
+
+        if self.positional and phrases:
+            keep = np.isin(doc_ids, self.phrase_matches(phrases))
+            doc_ids, scores = doc_ids[keep], scores[keep]
+
+        if sources:
+            keep = self.sources.mask(sources)[doc_ids]
+            doc_ids, scores = doc_ids[keep], scores[keep]
+
+        if self.positional and len(set(q_tokens)) > 1:
+            ranked = self._top_k_sparse(doc_ids, scores, max(top_k, PROXIMITY_CANDIDATES), pad=False)
+            return self._proximity_rerank(ranked, q_tokens)[:top_k]
+        return self._top_k_sparse(doc_ids, scores, top_k, pad=False)
+
+    def phrase_matches(self, phrases):
+        """Sorted doc IDs containing every phrase."""
+        matched = None
+        for phrase in phrases:
+            docs = self.phrase_docs(phrase)
+            matched = docs if matched is None else np.intersect1d(matched, docs, assume_unique=True)
+            if not len(matched):
+                break
+        return matched
+
+    def phrase_docs(self, phrase):
+        """Sorted doc IDs containing the phrase, from (offset, term) pairs.
+
+        Doc lists of the phrase terms are intersected first, so positions are
+        only decoded for documents that have every term.
+        """
+        term_ids = [(offset, self.inverted_index.term_id(term)) for offset, term in phrase]
+        if any(term_id < 0 for _, term_id in term_ids):
+            return np.zeros(0, dtype=np.uint32)
+
+        candidates = None
+        for _, term_id in sorted(term_ids, key=lambda x: len(self.positions.docs(x[1]))):
+            docs = self.positions.docs(term_id)
+            candidates = docs if candidates is None else np.intersect1d(candidates, docs, assume_unique=True)
+        if len(term_ids) == 1:
+            return np.array(candidates)
+
+        # Index of each candidate in every term's doc-ordered postings.
+        indexes = [np.searchsorted(self.positions.docs(term_id), candidates).tolist() for _, term_id in term_ids]
+
+        matched = []
+        for j, doc_id in enumerate(candidates.tolist()):
+            starts = None
+            for (offset, term_id), term_indexes in zip(term_ids, indexes):
+                term_starts = {pos - offset for pos in self.positions.positions(term_id, term_indexes[j])}
+                starts = term_starts if starts is None else starts & term_starts
+                if not starts:
+                    break
+            if starts:
+                matched.append(doc_id)
+
+        METRICS.inc("search_phrase_candidates_total", len(candidates))
+        return np.array(matched, dtype=np.uint32)
+
+    def _proximity_rerank(self, ranked, q_tokens):
+        """Multiplies each positive score by its proximity boost and re-sorts;
+        zero-score padding stays at the end in doc ID order."""
+        scored = [(doc_id, score) for doc_id, score in ranked if score > 0]
+        padding = [(doc_id, score) for doc_id, score in ranked if score <= 0]
+        if not scored:
+            return ranked
+
+        term_ids = []
+        for t in dict.fromkeys(q_tokens):
+            term_id = self.inverted_index.term_id(t)
+            if term_id >= 0:
+                term_ids.append(term_id)
+        if len(term_ids) < 2:
+            return ranked
+
+        boosts = self.proximity_boosts([doc_id for doc_id, _ in scored], term_ids)
+        scored = [(doc_id, score * boost) for (doc_id, score), boost in zip(scored, boosts)]
+        scored.sort(key=lambda x: (-x[1], x[0]))
+        return scored + padding
+
+    def proximity_boosts(self, doc_ids, term_ids):
+        """Per document, 1 + PROXIMITY_WEIGHT * the mean over consecutive query
+        term pairs of 1 / (smallest distance between them); pairs that do not
+        both occur in the document add nothing."""
+        candidates = np.asarray(doc_ids, dtype=np.uint32)
+        indexes = []
+        for term_id in term_ids:
+            docs = self.positions.docs(term_id)
+            found = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+            indexes.append(np.where(docs[found] == candidates, found, -1).tolist())
+
+        boosts = []
+        for j in range(len(candidates)):
+            positions = [self.positions.positions(term_id, term_indexes[j]) if term_indexes[j] >= 0 else None
+                         for term_id, term_indexes in zip(term_ids, indexes)]
+            closeness = sum(1.0 / min_distance(a, b) for a, b in zip(positions, positions[1:]) if a and b)
+            boosts.append(1.0 + PROXIMITY_WEIGHT * closeness / (len(term_ids) - 1))
+
+        return boosts
+
+    def search(self, query, model=None):
+        q_tokens, top = self.rank(query, model=model)
+        return self._search_results(q_tokens, top)
+
+    def search_many(self, queries, top_k=TOP_K, with_paragraphs=True, model=None):
+        """search() for a batch of queries, scored together by rank_many."""
+        token_lists, rankings = self.rank_many(queries, top_k, model)
+        return [self._search_results(q_tokens, top, with_paragraphs)
+                for q_tokens, top in zip(token_lists, rankings)]
+
+    def _search_results(self, q_tokens, top, with_paragraphs=True):
         results = []
-        for doc_id, score in scores[:TOP_K]:
-            paragraph = self.get_best_paragraph(self.docs[doc_id], q_tokens)
+        for doc_id, score in top:
+            paragraph = self.best_paragraph(doc_id, q_tokens) if with_paragraphs else None
             filename = self.doc_filenames[doc_id]
 
             results.append({
                 "doc_id": doc_id,
                 "score": float(score),
                 "paragraph": paragraph,
-                "filename": filename
+                "filename": filename,
+                "source": self.manifest[doc_id]["source"],
             })
 
         return results
+
+
+def min_distance(a, b):
+    """Smallest |x - y| between two ascending position lists."""
+    best = math.inf
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] < b[j]:
+            best = min(best, b[j] - a[i])
+            i += 1
+        else:
+            best = min(best, a[i] - b[j])
+            j += 1
+    return best
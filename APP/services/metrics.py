@@ -0,0 +1,105 @@
+import time
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Number of recent samples per stage the quantiles are computed from.
+WINDOW_SIZE = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class Metrics:
+    """In-process stage latencies and counters, rendered in Prometheus text format.
+
+    Latencies are exported as summaries: quantiles over a sliding window of
+    the last WINDOW_SIZE samples, plus the all-time sum and count. Values are
+    per process, so each gunicorn worker reports its own.
+    """
+
+    def __init__(self, window_size=WINDOW_SIZE):
+        self.window_size = window_size
+        self._samples = defaultdict(lambda: deque(maxlen=self.window_size))
+        self._sums = defaultdict(float)
+        self._counts = defaultdict(int)
+        self._counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self._samples[stage].append(seconds)
+            self._sums[stage] += seconds
+            self._counts[stage] += 1
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def quantiles(self, stage):
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if not samples:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: samples[min(int(q * len(samples)), len(samples) - 1)] for q in QUANTILES}
+
+    def render(self, gauges=None):
+        """Prometheus text exposition of every stage, counter and the given gauges."""
+        with self._lock:
+            stages = sorted(self._samples)
+            sums = dict(self._sums)
+            counts = dict(self._counts)
+            counters = dict(self._counters)
+
+        lines = [
+            "# HELP search_stage_seconds Time spent in each stage of a search request.",
+            "# TYPE search_stage_seconds summary",
+        ]
+        for stage in stages:
+            for q, value in self.quantiles(stage).items():
+                lines.append(f'search_stage_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'search_stage_seconds_sum{{stage="{stage}"}} {sums[stage]:.6f}')
+            lines.append(f'search_stage_seconds_count{{stage="{stage}"}} {counts[stage]}')
+
+        for name in sorted(counters):
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {counters[name]}")
+
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def span(stage):
+    """Times the block into METRICS and into the current request's timings, if any."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        METRICS.observe(stage, elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def collect_timings():
+    """Collects the spans recorded inside the block as {stage: seconds}."""
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def format_timings(timings):
+    return ", ".join(f"{stage}={seconds * 1000:.3f}ms" for stage, seconds in timings.items())
@@ -0,0 +1,25 @@
+import nltk
+
+# (nltk.data path, downloader package) for every resource the engine and
+# summarizer use. Checked once at startup instead of at module import.
+REQUIRED_RESOURCES = [
+    ("tokenizers/punkt", "punkt"),
+    ("tokenizers/punkt_tab", "punkt_tab"),
+    ("corpora/stopwords", "stopwords"),
+    ("corpora/wordnet", "wordnet"),
+]
+
+
+def ensure_nltk_resources(resources=REQUIRED_RESOURCES):
+    """Downloads only the resources that are missing; returns their package names."""
+    missing = []
+    for path, package in resources:
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            missing.append(package)
+
+    for package in missing:
+        nltk.download(package, quiet=True)
+
+    return missing
@@ -0,0 +1,179 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from APP.services.metrics import METRICS
+
+# The SQLite table is trimmed back to max_entries after this fraction of
+# max_entries new rows, rather than after every write.
+TRIM_FRACTION = 0.1
+# Several workers may share one cache file; a search waits at most this long
+# for another worker's write before skipping the disk.
+BUSY_TIMEOUT_MS = 1000
+
+
+class QueryCache:
+    """Bounded LRU/TTL cache for search results, optionally backed by SQLite.
+
+    Keys embed the index version, and sync_version() drops everything cached
+    for an older index, so results never outlive a rebuild or update.
+    SQLite errors (e.g. a file locked by another worker) are logged and the
+    cache carries on from memory; they never fail a search.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = None
+
+        self.hits = 0
+        self.misses = 0
+
+        self.db_path = db_path
+        self.trim_every = max(1, int(max_entries * TRIM_FRACTION))
+        self._untrimmed = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._connect()
+
+    def _connect(self):
+        self._db = None
+        if not self.db_path:
+            return
+        try:
+            db = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+            db.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+            # Readers in other workers do not block on a writer.
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache ("
+                "key TEXT PRIMARY KEY, version TEXT, value TEXT, created REAL)"
+            )
+            db.commit()
+        except sqlite3.Error as e:
+            print(f"Opening the query cache database failed, caching in memory only: {e}")
+            METRICS.inc("query_cache_db_errors_total")
+            return
+        self._db = db
+
+    def _db_error(self, e):
+        print(f"Query cache database error: {e}")
+        METRICS.inc("query_cache_db_errors_total")
+        try:
+            self._db.rollback()
+        except sqlite3.Error:
+            pass
+
+    def after_fork(self):
+        """Gives a forked worker its own lock and SQLite connection."""
+        self._lock = threading.Lock()
+        self._connect()
+
+    @staticmethod
+    def make_key(version, q_tokens, *extra):
+        return json.dumps([version, list(q_tokens), *extra])
+
+    def sync_version(self, version):
+        if version != self.version:
+            self.invalidate(keep_version=version)
+
+    def invalidate(self, keep_version=None):
+        with self._lock:
+            self._entries.clear()
+            self.version = keep_version
+            if self._db is not None:
+                # Keys embed the version, so rows left behind by a failed
+                # delete are never read.
+                try:
+                    self._db.execute("DELETE FROM query_cache WHERE version IS NOT ?", (keep_version,))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    self._db_error(e)
+
+    def get(self, key):
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT value, created FROM query_cache WHERE key = ?", (key,)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    self._db_error(e)
+                    row = None
+                if row is not None:
+                    entry = (json.loads(row[0]), row[1])
+                    self._entries[key] = entry
+
+            if entry is not None and now - entry[1] > self.ttl:
+                self._delete(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                METRICS.inc("query_cache_misses_total")
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            METRICS.inc("query_cache_hits_total")
+            return entry[0]
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        """Caches (key, value) pairs; with SQLite, in a single transaction."""
+        items = list(items)
+        if not items:
+            return
+        now = time.time()
+
+        with self._lock:
+            for key, value in items:
+                self._entries[key] = (value, now)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+            if self._db is not None:
+                try:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO query_cache (key, version, value, created) VALUES (?, ?, ?, ?)",
+                        [(key, self.version, json.dumps(value), now) for key, value in items],
+                    )
+                    trim = self._untrimmed + len(items) >= self.trim_every
+                    if trim:
+                        self._db.execute(
+                            "DELETE FROM query_cache WHERE key NOT IN "
+                            "(SELECT key FROM query_cache ORDER BY created DESC LIMIT ?)",
+                            (self.max_entries,),
+                        )
+                    self._db.commit()
+                    self._untrimmed = 0 if trim else self._untrimmed + len(items)
+                except sqlite3.Error as e:
+                    self._db_error(e)
+
+    def _delete(self, key):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            try:
+                self._db.execute("DELETE FROM query_cache WHERE key = ?", (key,))
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._db_error(e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "version": self.version,
+            }
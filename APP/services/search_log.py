@@ -0,0 +1,125 @@
+import queue
+import datetime
+import threading
+
+from sqlalchemy import delete, insert, select
+
+from extensions import db
+from models.recent_search import RecentSearch
+from APP.services.metrics import METRICS
+
+BATCH_SIZE = 256
+# Searches kept per user; older rows are deleted as new ones are written.
+RETENTION = 200
+# Searches waiting to be written; beyond this, new ones are dropped rather
+# than slowing down requests.
+MAX_PENDING = 10000
+
+_STOP = object()
+
+
+class SearchLogWriter:
+    """Writes RecentSearch rows off the request path.
+
+    log() only enqueues. A daemon thread, started on first use so none runs
+    in a pre-fork master, commits whatever has queued up, up to batch_size
+    rows per transaction: one row per commit when idle, large batches under
+    load. Each batch also trims its users to their newest `retention` rows.
+    """
+
+    def __init__(self, app, batch_size=BATCH_SIZE, retention=RETENTION, max_pending=MAX_PENDING):
+        self.app = app
+        self.batch_size = batch_size
+        self.retention = retention
+        self.max_pending = max_pending
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def after_fork(self):
+        """Gives a forked worker its own queue; the writer thread restarts on first use."""
+        self._queue = queue.Queue(maxsize=self.max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def log(self, user_id, query_text):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((user_id, query_text, datetime.datetime.utcnow()))
+        except queue.Full:
+            METRICS.inc("search_log_dropped_total")
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self):
+        """Blocks until every search logged so far is written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stop(self, timeout=5):
+        """Writes what is queued, then stops the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="search-log", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not _STOP and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is _STOP
+            rows = batch[:-1] if stop else batch
+            if rows:
+                self._write(rows)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, rows):
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(RecentSearch), [
+                    {"user_id": user_id, "query_text": query_text, "timestamp": timestamp}
+                    for user_id, query_text, timestamp in rows
+                ])
+                for user_id in {user_id for user_id, _, _ in rows}:
+                    self._trim(user_id)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Writing search history failed: {e}")
+                METRICS.inc("search_log_errors_total")
+                return
+
+        METRICS.inc("search_log_batches_total")
+        METRICS.inc("search_log_rows_total", len(rows))
+
+    def _trim(self, user_id):
+        newest = (
+            select(RecentSearch.id)
+            .filter_by(user_id=user_id)
+            .order_by(RecentSearch.timestamp.desc(), RecentSearch.id.desc())
+            .limit(self.retention)
+        )
+        db.session.execute(
+            delete(RecentSearch)
+            .where(RecentSearch.user_id == user_id)
+            .where(RecentSearch.id.not_in(newest.scalar_subquery()))
+        )
@@ -0,0 +1,25 @@
+import re
+
+# Chunks written by older ingests start with "[SOURCE: <label>]"; the source
+# is now document metadata, so the tag is stripped before indexing.
+SOURCE_TAG_RE = re.compile(r"^\s*\[SOURCE:[^\]]*\]\s*")
+
+
+def source_label_for(path):
+    """Source label of a raw or processed file, from the folder it sits in."""
+    lower_path = path.lower()
+
+    if "reading_materials" in lower_path or "materials" in lower_path:
+        return "B.Tech CS Materials"
+    elif "mit_opencourseware" in lower_path:
+        return "MIT OpenCourseWare"
+    elif "openstax" in lower_path:
+        return "OpenStax"
+    elif "opentextbooklibrary" in lower_path or "opentextbook" in lower_path:
+        return "Open Textbook Library"
+    else:
+        return "General Resource"
+
+
+def strip_source_tag(text):
+    return SOURCE_TAG_RE.sub("", text, count=1)
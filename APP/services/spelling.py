@@ -0,0 +1,61 @@
+import re
+import zlib
+
+# Symmetric delete spelling correction (as in SymSpell): every indexed word
+# is stored under each string reachable from it by up to MAX_EDIT_DISTANCE
+# deletes, so the candidates for a misspelling are found by generating its
+# own deletes and looking them up, without scanning the vocabulary.
+MAX_EDIT_DISTANCE = 2
+# Deletes are generated from this many leading characters only, which bounds
+# the index size; candidates are checked against the whole word.
+PREFIX_LENGTH = 7
+# Words shorter than this are never corrected.
+MIN_WORD_LENGTH = 4
+# Dictionary words: seen in at least MIN_DF documents (words found in one
+# document are mostly typos themselves) and at least this long.
+MIN_DF = 2
+MIN_DICTIONARY_LENGTH = 3
+
+WORD_RE = re.compile(r"[A-Za-z]+")
+
+
+def max_distance_for(word):
+    """Edits allowed for a word: 1 up to 7 letters, then 2."""
+    return min(MAX_EDIT_DISTANCE, len(word) // 4)
+
+
+def deletes(word, max_distance=MAX_EDIT_DISTANCE):
+    """word[:PREFIX_LENGTH] and every string made from it by up to max_distance deletes."""
+    level = {word[:PREFIX_LENGTH]}
+    found = set(level)
+    for _ in range(max_distance):
+        level = {w[:i] + w[i + 1:] for w in level if len(w) > 1 for i in range(len(w))}
+        found |= level
+    return found
+
+
+def delete_key(text):
+    # 32-bit keys keep the index small; a collision only adds a candidate
+    # that fails the edit distance check.
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def edit_distance(a, b, max_distance):
+    """Optimal string alignment distance (adjacent swaps count as one edit),
+    or max_distance + 1 once it is certain to exceed max_distance."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, cur
+    return prev[-1] if prev[-1] <= max_distance else max_distance + 1
@@ -0,0 +1,151 @@
+import heapq
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from functools import lru_cache
+
+SUGGEST_LIMIT = 8
+# Words from a single document are mostly typos and extraction noise.
+MIN_TERM_DF = 2
+MAX_POPULAR_QUERIES = 5000
+# A query is only suggested to everyone once this many distinct users have
+# searched for it, so no single user's history is completed for others.
+MIN_POPULAR_USERS = 3
+# Queries searched since startup that have not reached MIN_POPULAR_USERS yet;
+# the least recently searched are forgotten beyond this.
+MAX_CANDIDATE_QUERIES = 20000
+TERM_PREFIX_CACHE_SIZE = 4096
+
+
+def normalize_query(text):
+    return " ".join(text.lower().split())
+
+
+class PrefixIndex:
+    """Weighted keys kept in a sorted list; completions are a bisect range.
+
+    complete() returns the heaviest keys under a prefix, ties in key order.
+    add() inserts with insort, so it suits small, growing key sets such as
+    logged queries as well as a vocabulary built once.
+    """
+
+    def __init__(self, weights=()):
+        self._weights = dict(weights)
+        self._keys = sorted(self._weights)
+        self._lock = threading.Lock()
+
+    def add(self, key, weight=1):
+        with self._lock:
+            if key not in self._weights:
+                insort(self._keys, key)
+                self._weights[key] = 0
+            self._weights[key] += weight
+
+    def pop_lightest(self):
+        """Removes and returns the key with the smallest weight."""
+        with self._lock:
+            key = min(self._weights, key=self._weights.__getitem__)
+            del self._weights[key]
+            del self._keys[bisect_left(self._keys, key)]
+            return key
+
+    def __contains__(self, key):
+        return key in self._weights
+
+    def complete(self, prefix, k):
+        with self._lock:
+            lo = bisect_left(self._keys, prefix)
+            hi = bisect_left(self._keys, prefix + "\U0010ffff", lo)
+            return heapq.nlargest(k, self._keys[lo:hi], key=self._weights.__getitem__)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class Suggester:
+    """Query completions for /suggest.
+
+    Suggestions come in three tiers: the user's own matching past queries
+    (newest first), then popular queries from everyone's search history (by
+    count), then completions of the word being typed from the index
+    vocabulary (by document frequency).
+
+    popular_queries: (query, count) pairs already searched by at least
+    MIN_POPULAR_USERS users. Queries recorded later join them once they
+    reach that many users; the tier holds at most MAX_POPULAR_QUERIES, the
+    least searched giving way to new ones.
+    """
+
+    def __init__(self, vocabulary, popular_queries=(), version=None):
+        self.queries = PrefixIndex(heapq.nlargest(MAX_POPULAR_QUERIES, popular_queries, key=lambda pair: pair[1]))
+        # query -> (count, user IDs) for queries not popular yet.
+        self._candidates = OrderedDict()
+        self._lock = threading.Lock()
+        self.update_vocabulary(vocabulary, version)
+
+    def update_vocabulary(self, vocabulary, version=None):
+        """vocabulary: (word, df) pairs, e.g. IREngine.vocabulary()."""
+        terms = PrefixIndex((word, df) for word, df in vocabulary if df >= MIN_TERM_DF and word.isalpha())
+        # Short prefixes cover thousands of words; the vocabulary only
+        # changes with the index, so their completions are cached.
+        self._complete_term = lru_cache(maxsize=TERM_PREFIX_CACHE_SIZE)(terms.complete)
+        self.terms = terms
+        self.version = version
+
+    def record_query(self, query, user_id):
+        query = normalize_query(query)
+        if not query:
+            return
+        if query in self.queries:
+            self.queries.add(query)
+            return
+
+        with self._lock:
+            count, users = self._candidates.pop(query, (0, frozenset()))
+            count, users = count + 1, users | {user_id}
+            if len(users) < MIN_POPULAR_USERS:
+                self._candidates[query] = (count, users)
+                if len(self._candidates) > MAX_CANDIDATE_QUERIES:
+                    self._candidates.popitem(last=False)
+                return
+
+        if len(self.queries) >= MAX_POPULAR_QUERIES:
+            self.queries.pop_lightest()
+        self.queries.add(query, count)
+
+    def suggest(self, text, history=(), limit=SUGGEST_LIMIT):
+        """Up to limit {"text", "kind"} suggestions for the typed text.
+
+        history: the user's recent queries, newest first.
+        """
+        prefix = normalize_query(text)
+        if not prefix:
+            return []
+        # A trailing space means the last word is finished: complete the
+        # next word of a query, not the current one.
+        ends_word = text[-1:].isspace()
+        if ends_word:
+            prefix += " "
+
+        suggestions = []
+        seen = {prefix.rstrip()}
+
+        def add(candidate, kind):
+            if candidate not in seen and len(suggestions) < limit:
+                seen.add(candidate)
+                suggestions.append({"text": candidate, "kind": kind})
+
+        for past in history:
+            past = normalize_query(past)
+            if past.startswith(prefix):
+                add(past, "history")
+
+        for query in self.queries.complete(prefix, limit):
+            add(query, "popular")
+
+        if not ends_word:
+            head, _, last = prefix.rpartition(" ")
+            for word in self._complete_term(last, limit):
+                add(f"{head} {word}" if head else word, "term")
+
+        return suggestions
@@ -1,14 +1,22 @@
 import re
+import math
 import nltk
+import numpy as np
+from collections import defaultdict
 from nltk.tokenize import sent_tokenize
-from sklearn.feature_extraction.text import TfidfVectorizer
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, TfidfVectorizer
 
-nltk.download('punkt', quiet=True)
+# TfidfVectorizer's default token pattern.
+WORD_RE = re.compile(r"(?u)\b\w\w+\b")
 
 class Summarizer:
 
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(stop_words='english')
+    def __init__(self, ir_engine=None):
+        # With an IREngine, sentences are weighted with the corpus IDF; without
+        # one, a TfidfVectorizer is fitted per call on the query and the sentences.
+        # Both split words the same way, so they mostly pick the same sentences.
+        self.ir_engine = ir_engine
 
     def clean_text(self, text):
         text = re.sub(r"\.{3,}", " ", text)
@@ -55,14 +63,86 @@ class Summarizer:
         if not sentences:
             return []
 
+        if self.ir_engine is not None:
+            return self.score_sentence_groups([sentences], query)[0]
+
+        # A fresh vectorizer per call: fit_transform mutates it, so sharing
+        # one across request threads is not safe.
+        vectorizer = TfidfVectorizer(stop_words='english')
         corpus = [query] + sentences
-        tfidf = self.vectorizer.fit_transform(corpus)
+        tfidf = vectorizer.fit_transform(corpus)
         query_vec = tfidf[0]
         sent_vecs = tfidf[1:]
 
         scores = (sent_vecs * query_vec.T).toarray().flatten()
         return scores
 
+    def words(self, text):
+        """Lowercased words of 2+ characters minus scikit-learn's English stop
+        words, as TfidfVectorizer(stop_words='english') splits text."""
+        return [w for w in WORD_RE.findall(text.lower()) if w not in ENGLISH_STOP_WORDS]
+
+    def word_idf(self, word):
+        """Smoothed corpus IDF, ln((1 + N) / (1 + df)) + 1 as in TfidfVectorizer,
+        with df that of the word's index term. Words the index drops (its own
+        stop words) count as found in every document."""
+        engine = self.ir_engine
+        terms = engine.preprocess(word, fast=True)
+        df = engine.term_df.get(terms[0], 0) if terms else engine.N
+        return math.log((1 + engine.N) / (1 + df)) + 1
+
+    def score_sentence_groups(self, sentence_groups, query):
+        """Cosine scores of every sentence of every group against the query, in one sparse product."""
+        idf = {}
+
+        def weights(text):
+            tf = defaultdict(int)
+            for w in self.words(text):
+                tf[w] += 1
+            for w, freq in tf.items():
+                if w not in idf:
+                    idf[w] = self.word_idf(w)
+                yield w, freq * idf[w]
+
+        columns = {}
+        q_weights = {}
+        for t, weight in weights(query):
+            q_weights[columns.setdefault(t, len(columns))] = weight
+
+        data, indices, indptr = [], [], [0]
+        for sentences in sentence_groups:
+            for sentence in sentences:
+                row = {columns.setdefault(t, len(columns)): weight for t, weight in weights(sentence)}
+
+                length = math.sqrt(sum(w * w for w in row.values()))
+                for col, weight in row.items():
+                    indices.append(col)
+                    data.append(weight / length)
+                indptr.append(len(indices))
+
+        sent_vecs = csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, max(len(columns), 1)))
+
+        query_vec = np.zeros(sent_vecs.shape[1])
+        q_len = math.sqrt(sum(w * w for w in q_weights.values()))
+        for col, weight in q_weights.items():
+            query_vec[col] = weight / q_len
+
+        scores = sent_vecs @ query_vec
+
+        groups = []
+        start = 0
+        for sentences in sentence_groups:
+            groups.append(scores[start:start + len(sentences)])
+            start += len(sentences)
+        return groups
+
+    def _pick_sentences(self, sentences, scores, max_sentences):
+        ranked = sorted(zip(sentences, scores), key=lambda x: x[1], reverse=True)
+
+        best_sentences = [s for s, _ in ranked[:max_sentences]]
+        summary = " ".join(best_sentences)
+        return summary.strip()
+
     def summarize(self, paragraph, query, max_sentences=3):
         paragraph = self.clean_text(paragraph)
         sentences = self.extract_sentences(paragraph)
@@ -71,8 +151,23 @@ class Summarizer:
             return paragraph[:250] + "..."
 
         scores = self.score_sentences(sentences, query)
-        ranked = sorted(zip(sentences, scores), key=lambda x: x[1], reverse=True)
-
-        best_sentences = [s for s, _ in ranked[:max_sentences]]
-        summary = " ".join(best_sentences)
-        return summary.strip()
+        return self._pick_sentences(sentences, scores, max_sentences)
+
+    def summarize_many(self, paragraphs, query, max_sentences=3):
+        """Summarizes the paragraphs of several hits, scoring all their sentences in one batch."""
+        if self.ir_engine is None:
+            return [self.summarize(p, query, max_sentences) for p in paragraphs]
+
+        cleaned = [self.clean_text(p) for p in paragraphs]
+        sentence_groups = [self.extract_sentences(p) for p in cleaned]
+
+        groups = [g for g in sentence_groups if g]
+        scores = iter(self.score_sentence_groups(groups, query) if groups else [])
+
+        summaries = []
+        for paragraph, sentences in zip(cleaned, sentence_groups):
+            if not sentences:
+                summaries.append(paragraph[:250] + "...")
+            else:
+                summaries.append(self._pick_sentences(sentences, next(scores), max_sentences))
+        return summaries
@@ -1,12 +1,14 @@
 import os
 import sys
+import atexit
 import threading
-import webview
 from flask import Flask
+from sqlalchemy import event
 from extensions import db, login_manager
-from routes import main_bp 
-from APP.services.ir_engine import IREngine
-from APP.services.summarizer import Summarizer
+from routes import main_bp, get_suggester
+from APP.services.engine_loader import EngineLoader
+from APP.services.query_cache import QueryCache
+from APP.services.search_log import SearchLogWriter
 
 project_root = os.path.abspath(os.path.dirname(__file__))
 if project_root not in sys.path:
@@ -22,9 +24,34 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or f'sqlite:///{DATABASE_FILE}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     FLASK_DEBUG = True
-
-
-def create_app():
+    QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 1024))
+    QUERY_CACHE_TTL = int(os.environ.get('QUERY_CACHE_TTL', 3600))
+    # Set to a file path (e.g. data/query_cache.db) to keep cached results across restarts.
+    QUERY_CACHE_DB = os.environ.get('QUERY_CACHE_DB')
+    # "postings" (term-at-a-time) or "csr" (SciPy sparse matrix); see IREngine.
+    SCORING_BACKEND = os.environ.get('SCORING_BACKEND', 'postings')
+    # Default ranking model, "tfidf" or "bm25"; requests can pick one with a model field.
+    RANKING_MODEL = os.environ.get('RANKING_MODEL', 'tfidf')
+    # Index token positions for "quoted phrase" queries and proximity ranking.
+    POSITIONAL_INDEX = os.environ.get('POSITIONAL_INDEX') == '1'
+    # Always send per-stage timings in an X-Search-Timing header on /perform_search.
+    SEARCH_TIMING_HEADER = os.environ.get('SEARCH_TIMING_HEADER') == '1'
+    # Search history is written in the background, at most this many rows per commit.
+    SEARCH_LOG_BATCH_SIZE = int(os.environ.get('SEARCH_LOG_BATCH_SIZE', 256))
+    # Recent searches kept per user.
+    RECENT_SEARCH_RETENTION = int(os.environ.get('RECENT_SEARCH_RETENTION', 200))
+
+
+def enable_sqlite_wal(dbapi_connection, connection_record):
+    # WAL lets searches read while the history writer commits, and with
+    # synchronous=NORMAL a commit no longer waits for an fsync.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def create_app(background_load=True):
     app = Flask(__name__, template_folder='templates', static_folder='static')
     app.config.from_object(Config)
 
@@ -40,8 +67,16 @@ def create_app():
     app.register_blueprint(main_bp)
 
     with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            event.listen(db.engine, "connect", enable_sqlite_wal)
         db.create_all()
 
+        # create_all() skips tables that already exist, so indexes added to
+        # a model later are created here for existing databases.
+        from models.recent_search import RecentSearch
+        for index in RecentSearch.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+
         processed_data_path = os.path.join(project_root, "data", "processed_data")
 
         def folder_has_txt(path):
@@ -51,15 +86,51 @@ def create_app():
                         return True
             return False
 
+        app.config['IR_ENGINE'] = None
+        app.config['SUMMARIZER'] = None
+
+        search_log = SearchLogWriter(
+            app,
+            batch_size=app.config['SEARCH_LOG_BATCH_SIZE'],
+            retention=app.config['RECENT_SEARCH_RETENTION'],
+        )
+        app.config['SEARCH_LOG'] = search_log
+        atexit.register(search_log.stop)
+
         if not folder_has_txt(processed_data_path):
             print(f"WARNING: No processed data found at {processed_data_path}. "
                   f"Run: python3 back_end_processing/collect_and_clean_data.py")
-            app.config['IR_ENGINE'] = None
-            app.config['SUMMARIZER'] = None
         else:
-            app.config['IR_ENGINE'] = IREngine(processed_data_path)
-            app.config['SUMMARIZER'] = Summarizer()
-            print("IR Engine and Summarizer initialized successfully.")
+            app.config['QUERY_CACHE'] = QueryCache(
+                max_entries=app.config['QUERY_CACHE_SIZE'],
+                ttl=app.config['QUERY_CACHE_TTL'],
+                db_path=app.config['QUERY_CACHE_DB'],
+            )
+
+            def engine_ready(ir_engine, summarizer):
+                # Built here so the first /suggest keystroke does not pay for
+                # it, and before publishing the engine: if this raises, the
+                # loader reports "failed" and searches stay unavailable.
+                with app.app_context():
+                    get_suggester(ir_engine)
+                app.config['IR_ENGINE'] = ir_engine
+                app.config['SUMMARIZER'] = summarizer
+
+            # Search routes answer "warming_up" until the loader has finished.
+            loader = EngineLoader(
+                processed_data_path,
+                on_ready=engine_ready,
+                engine_options={
+                    'scoring_backend': app.config['SCORING_BACKEND'],
+                    'ranking_model': app.config['RANKING_MODEL'],
+                    'positional': app.config['POSITIONAL_INDEX'],
+                },
+            )
+            app.config['ENGINE_LOADER'] = loader
+            if background_load:
+                loader.start()
+            else:
+                loader.load()
 
     return app
 
@@ -70,6 +141,8 @@ def run_flask():
 
 if __name__ == '__main__':
     if 'DISPLAY' in os.environ or os.getenv('WSL_DISTRO_NAME') or sys.platform == 'darwin':
+        # Imported here so serve.py can load the app on headless servers.
+        import webview
         threading.Thread(target=run_flask, daemon=True).start()
         import time
         time.sleep(1)
@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+from collections import Counter
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from APP.services.ir_engine import IREngine
+
+PROCESSED_DATA_DIR = os.path.join(project_root, "data", "processed_data")
+
+
+def load_sample_texts(folder=PROCESSED_DATA_DIR):
+    texts = []
+    for root, dirs, files in os.walk(folder):
+        for file in sorted(files):
+            if file.lower().endswith(".txt"):
+                with open(os.path.join(root, file), "r", encoding="utf-8") as f:
+                    texts.append(f.read())
+    return texts
+
+
+def iter_synthetic_docs(n_docs, sample_texts, seed=0):
+    """Yields n_docs chunks made by shuffling the words of randomly picked real chunks."""
+    rng = random.Random(seed)
+    for _ in range(n_docs):
+        words = rng.choice(sample_texts).split()
+        rng.shuffle(words)
+        yield " ".join(words)
+
+
+def make_synthetic_docs(n_docs, sample_texts, seed=0):
+    return list(iter_synthetic_docs(n_docs, sample_texts, seed))
+
+
+def make_queries(sample_texts, n_queries, seed=0):
+    """Builds 1-3 word queries from words of the sample chunks."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        words = [w for w in rng.choice(sample_texts).split() if w.isalpha() and len(w) > 3]
+        queries.append(" ".join(rng.sample(words, min(len(words), rng.randint(1, 3)))))
+    return queries
+
+
+def make_phrase_queries(sample_texts, n_queries, seed=0):
+    """Builds quoted 2-3 word phrases from consecutive words of the sample chunks."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        words = [w for w in rng.choice(sample_texts).split() if w.isalpha()]
+        length = min(len(words), rng.randint(2, 3))
+        start = rng.randrange(len(words) - length + 1) if words else 0
+        queries.append('"' + " ".join(words[start:start + length]) + '"')
+    return queries
+
+
+def make_typo_queries(queries, seed=0):
+    """Copies of queries with one letter dropped, replaced or swapped in every word of 5+ letters."""
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+
+    def typo(word):
+        if len(word) < 5:
+            return word
+        i = rng.randrange(1, len(word) - 1)
+        return rng.choice([
+            word[:i] + word[i + 1:],
+            word[:i] + rng.choice(letters) + word[i + 1:],
+            word[:i] + word[i + 1] + word[i] + word[i + 2:],
+        ])
+
+    return [" ".join(typo(word) for word in q.split()) for q in queries]
+
+
+def bench_tfidf_build(sizes, sample_texts):
+    print(f"{'docs':>8} {'postings':>10} {'build_index':>12} {'tfidf':>10} {'tfidf/1k postings':>18}")
+
+    with tempfile.TemporaryDirectory() as empty_dir:
+        ir_engine = IREngine(empty_dir)
+
+        for n in sizes:
+            docs = make_synthetic_docs(n, sample_texts)
+            ir_engine.N = n
+
+            start = time.perf_counter()
+            ir_engine.build_index(docs)
+            index_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            ir_engine.build_tfidf_vectors()
+            tfidf_time = time.perf_counter() - start
+
+            postings = sum(len(p) for p in ir_engine.inverted_index.values())
+            per_k_ms = tfidf_time / postings * 1e6 if postings else 0.0
+
+            print(f"{n:>8} {postings:>10} {index_time:>11.2f}s {tfidf_time:>9.3f}s {per_k_ms:>16.3f}ms")
+
+
+def bench_tokenizer(sample_texts):
+    with tempfile.TemporaryDirectory() as empty_dir:
+        engines = {
+            "nltk": IREngine(empty_dir),
+            "fast": IREngine(empty_dir, fast_tokenizer=True),
+        }
+
+    outputs = {}
+    print(f"{'tokenizer':>10} {'cold':>10} {'warm':>10} {'tokens':>10}")
+    for name, ir_engine in engines.items():
+        start = time.perf_counter()
+        outputs[name] = [ir_engine.preprocess(text) for text in sample_texts]
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for text in sample_texts:
+            ir_engine.preprocess(text)
+        warm = time.perf_counter() - start
+
+        tokens = sum(len(toks) for toks in outputs[name])
+        print(f"{name:>10} {cold:>9.2f}s {warm:>9.2f}s {tokens:>10}")
+
+    total = differing = identical = 0
+    for reference, fast in zip(outputs["nltk"], outputs["fast"]):
+        a, b = Counter(reference), Counter(fast)
+        total += sum(a.values())
+        differing += sum(((a - b) + (b - a)).values())
+        identical += reference == fast
+
+    token_agreement = 1 - differing / (2 * total) if total else 1.0
+    print(f"Token agreement: {token_agreement:.4%}, identical documents: {identical}/{len(sample_texts)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark IR index construction.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[250, 500, 1000, 2000])
+    parser.add_argument("--tokenizer", action="store_true", help="compare the NLTK and fast tokenizers")
+    args = parser.parse_args()
+
+    sample_texts = load_sample_texts()
+    if args.tokenizer:
+        bench_tokenizer(sample_texts)
+    else:
+        bench_tfidf_build(args.sizes, sample_texts)
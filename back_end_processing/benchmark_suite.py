@@ -0,0 +1,355 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import subprocess
+import tracemalloc
+from collections import Counter
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from APP.services.ir_engine import IREngine, SCORING_BACKENDS
+from APP.services.summarizer import Summarizer
+from APP.services.suggest import Suggester, normalize_query
+from APP.services.nltk_resources import ensure_nltk_resources
+from back_end_processing.benchmark_ir import (load_sample_texts, iter_synthetic_docs, make_queries,
+                                             make_phrase_queries, make_typo_queries)
+
+DEFAULT_SIZES = [1000, 10000]
+DEFAULT_OUTPUT = os.path.join(project_root, "data", "benchmark_results.json")
+REGRESSION_THRESHOLD = 0.20
+IGNORED_IN_COMPARE = ("docs", "postings", "terms", "csr_ranking_mismatches", "bm25_early_mismatches",
+                      "spelling_corrected", "summary_sentence_agreement")
+
+
+def generate_corpus(out_dir, n_chunks, sample_texts, seed=0):
+    """Writes n_chunks synthetic chunks to out_dir/synthetic, like processed_data."""
+    chunk_dir = os.path.join(out_dir, "synthetic")
+    os.makedirs(chunk_dir, exist_ok=True)
+    for i, text in enumerate(iter_synthetic_docs(n_chunks, sample_texts, seed)):
+        with open(os.path.join(chunk_dir, f"chunk_{i:06d}.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+    return out_dir
+
+
+def iter_corpus_texts(folder):
+    for root, dirs, files in os.walk(folder):
+        for file in sorted(files):
+            if file.lower().endswith(".txt"):
+                with open(os.path.join(root, file), "r", encoding="utf-8") as f:
+                    yield f.read()
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def evict_from_page_cache(paths):
+    """Asks the OS to drop the files' cached pages, so the next read comes from
+    disk. Returns False where posix_fadvise is unavailable (macOS, Windows)."""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            # Dirty pages cannot be dropped until they are written.
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return True
+
+
+def timed_load_in_new_process(corpus_dir):
+    """Seconds IREngine(corpus_dir) takes in a fresh interpreter, where no
+    module-level or engine cache is warm yet; imports are not counted."""
+    code = (
+        "import sys, time\n"
+        f"sys.path.insert(0, {project_root!r})\n"
+        "from APP.services.ir_engine import IREngine\n"
+        "start = time.perf_counter()\n"
+        "IREngine(sys.argv[1])\n"
+        "print(time.perf_counter() - start)\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code, corpus_dir], capture_output=True, text=True, check=True)
+    return float(out.stdout.split()[-1])
+
+
+def peak_memory(fn):
+    """Peak bytes allocated by Python while fn runs (tracemalloc slows it, so time it separately)."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def latency_stats(latencies):
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return ordered[min(int(p * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+    return {
+        "total": sum(ordered),
+        "mean": sum(ordered) / len(ordered) if ordered else 0.0,
+        "p50": pct(0.50),
+        "p95": pct(0.95),
+    }
+
+
+def run_queries(fn, queries):
+    latencies = []
+    results = []
+    for q in queries:
+        elapsed, result = timed(lambda: fn(q))
+        latencies.append(elapsed)
+        results.append(result)
+    return latency_stats(latencies), results
+
+
+def bench_corpus(corpus_dir, n_docs, queries, phrase_queries, measure_memory):
+    results = {"docs": n_docs}
+
+    # Index construction on its own, from texts streamed off disk.
+    with tempfile.TemporaryDirectory() as empty_dir:
+        engine = IREngine(empty_dir)
+        engine.N = n_docs
+
+        results["build_index"], _ = timed(lambda: engine.build_index(iter_corpus_texts(corpus_dir)))
+        results["build_tfidf_vectors"], _ = timed(engine.build_tfidf_vectors)
+        results["postings"] = sum(len(p) for p in engine.inverted_index.values())
+        results["terms"] = len(engine.inverted_index)
+
+        if measure_memory:
+            results["build_index_peak_bytes"] = peak_memory(
+                lambda: engine.build_index(iter_corpus_texts(corpus_dir)))
+            results["build_tfidf_vectors_peak_bytes"] = peak_memory(engine.build_tfidf_vectors)
+        del engine
+
+    # Full build as the app does it (scan, index, write index.bin and corpus.bin).
+    results["full_build"], _ = timed(lambda: IREngine(corpus_dir))
+    results["index_bytes"] = os.path.getsize(os.path.join(corpus_dir, "index.bin"))
+    results["corpus_bytes"] = os.path.getsize(os.path.join(corpus_dir, "corpus.bin"))
+
+    # Cold: a new process with index.bin and corpus.bin evicted from the page
+    # cache, as after a reboot. Where they cannot be evicted, only the process
+    # is fresh, and the figure is recorded under its own name. Warm: a reload
+    # in this process, with the files still cached.
+    index_files = [os.path.join(corpus_dir, name) for name in ("index.bin", "corpus.bin")]
+    cold_key = "load_cold" if evict_from_page_cache(index_files) else "load_new_process"
+    results[cold_key] = timed_load_in_new_process(corpus_dir)
+    results["load_warm"], engine = timed(lambda: IREngine(corpus_dir))
+    if measure_memory:
+        results["load_peak_bytes"] = peak_memory(lambda: IREngine(corpus_dir))
+
+    # Cold: a fresh engine, so token, term and paragraph caches are empty.
+    results["search_cold"], hits = run_queries(engine.search, queries)
+    results["search_warm"], _ = run_queries(engine.search, queries)
+    if measure_memory:
+        fresh = IREngine(corpus_dir)
+        results["search_peak_bytes"] = peak_memory(lambda: [fresh.search(q) for q in queries])
+
+    # Autocomplete, one call per keystroke of the first word of each query.
+    popular = Counter(normalize_query(q) for q in queries).items()
+    results["suggest_build"], suggester = timed(lambda: Suggester(engine.vocabulary(), popular))
+    keystrokes = [q[:n] for q in queries for n in range(1, len(q.split()[0]) + 1)]
+    results["suggest"], _ = run_queries(suggester.suggest, keystrokes)
+
+    # Spelling correction of the same queries with typos in their longer words.
+    results["correct_query"], corrections = run_queries(engine.correct_query, make_typo_queries(queries))
+    results["spelling_corrected"] = sum(c is not None for c in corrections)
+
+    # Scoring backends alone, on the same tokenized queries.
+    token_lists = [engine.preprocess(q) for q in queries]
+    results["csr_matrix_build"], _ = timed(engine.term_doc_matrix)
+    rankings = {}
+    for backend in SCORING_BACKENDS:
+        engine.scoring_backend = backend
+        results[f"rank_{backend}"], rankings[backend] = run_queries(engine.rank_tokens, token_lists)
+    engine.scoring_backend = "postings"
+
+    pairs = list(zip(rankings["postings"], rankings["csr"]))
+    results["csr_ranking_mismatches"] = sum(
+        [doc_id for doc_id, _ in a] != [doc_id for doc_id, _ in b] for a, b in pairs)
+    results["csr_max_score_diff"] = max(
+        (abs(x[1] - y[1]) for a, b in pairs for x, y in zip(a, b)), default=0.0)
+
+    # BM25 scoring every posting, then stopping early on the impact-ordered lists.
+    bm25_rankings = {}
+    for early in (False, True):
+        engine.early_termination = early
+        name = "rank_bm25_early" if early else "rank_bm25"
+        results[name], bm25_rankings[name] = run_queries(
+            lambda q_tokens: engine.rank_tokens(q_tokens, model="bm25"), token_lists)
+    results["bm25_early_mismatches"] = sum(
+        a != b for a, b in zip(bm25_rankings["rank_bm25"], bm25_rankings["rank_bm25_early"]))
+
+    summarizer = Summarizer(engine)
+    paragraphs = {q: (r[0]["paragraph"] if r else "") for q, r in zip(queries, hits)}
+
+    def summarize(q):
+        return summarizer.summarize(paragraphs[q], q)
+
+    results["summarize_cold"], _ = run_queries(summarize, queries)
+    results["summarize_warm"], _ = run_queries(summarize, queries)
+
+    # Share of the sentences picked with the corpus IDF that a TfidfVectorizer
+    # fitted per paragraph (Summarizer without an engine) picks too.
+    fitted = Summarizer()
+    picked = agreed = 0
+    for q in queries:
+        sentences = fitted.extract_sentences(fitted.clean_text(paragraphs[q]))
+        if not sentences:
+            continue
+        ours, theirs = [
+            {s for s, _ in sorted(zip(sentences, scores), key=lambda x: x[1], reverse=True)[:3]}
+            for scores in (summarizer.score_sentences(sentences, q), fitted.score_sentences(sentences, q))
+        ]
+        picked += len(theirs)
+        agreed += len(ours & theirs)
+    results["summary_sentence_agreement"] = agreed / picked if picked else 1.0
+    if measure_memory:
+        results["summarize_peak_bytes"] = peak_memory(lambda: [summarize(q) for q in queries])
+
+    # Positional index: the extra size, then ranking with the proximity rerank
+    # (same queries as rank_postings) and with quoted phrases.
+    results["full_build_positional"], engine = timed(lambda: IREngine(corpus_dir, positional=True))
+    results["index_positional_bytes"] = os.path.getsize(os.path.join(corpus_dir, "index.bin"))
+
+    def rank_parsed(parsed):
+        q_tokens, phrases = parsed
+        return engine.rank_tokens(q_tokens, phrases=phrases)
+
+    results["rank_proximity"], _ = run_queries(rank_parsed, [engine.parse_query(q) for q in queries])
+    results["rank_phrase"], _ = run_queries(rank_parsed, [engine.parse_query(q) for q in phrase_queries])
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_root,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes, n_queries, seed, measure_memory, work_dir=None):
+    ensure_nltk_resources()
+    sample_texts = load_sample_texts()
+    queries = make_queries(sample_texts, n_queries, seed)
+    phrase_queries = make_phrase_queries(sample_texts, n_queries, seed)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "queries": n_queries,
+            "sample_chunks": len(sample_texts),
+        },
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base_dir = work_dir or tmp_dir
+        for n in sizes:
+            corpus_dir = os.path.join(base_dir, f"corpus_{n}")
+            if not os.path.isdir(corpus_dir):
+                print(f"Generating {n} synthetic chunks…")
+                generate_corpus(corpus_dir, n, sample_texts, seed)
+            for name in ("index.bin", "corpus.bin"):
+                path = os.path.join(corpus_dir, name)
+                if os.path.exists(path):
+                    os.remove(path)
+
+            print(f"Benchmarking {n} chunks…")
+            report["results"][str(n)] = bench_corpus(corpus_dir, n, queries, phrase_queries, measure_memory)
+            print_results(report["results"][str(n)])
+
+    return report
+
+
+def print_results(results):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            print(f"  {key:<28} mean {value['mean'] * 1000:8.2f}ms  p50 {value['p50'] * 1000:8.2f}ms  "
+                  f"p95 {value['p95'] * 1000:8.2f}ms")
+        elif key.endswith("_diff"):
+            print(f"  {key:<28} {value:10.2e}")
+        elif key.endswith("_bytes"):
+            print(f"  {key:<28} {value / 1e6:10.1f}MB")
+        elif key.endswith("_agreement"):
+            print(f"  {key:<28} {value:10.1%}")
+        elif isinstance(value, float):
+            print(f"  {key:<28} {value:10.3f}s")
+        else:
+            print(f"  {key:<28} {value:>10}")
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(baseline, report, threshold=REGRESSION_THRESHOLD):
+    """Prints every timing or memory figure that grew by more than threshold; returns their count."""
+    regressions = 0
+    for size, results in report["results"].items():
+        old = flatten(baseline.get("results", {}).get(size, {}))
+        for key, value in flatten(results).items():
+            if key not in old or not old[key] or key in IGNORED_IN_COMPARE or key.endswith("_diff"):
+                continue
+            change = value / old[key] - 1
+            if change > threshold:
+                regressions += 1
+                print(f"REGRESSION {size} {key}: {old[key]:.6g} -> {value:.6g} ({change:+.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark indexing, loading, search and summarization.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="synthetic corpus sizes (chunks)")
+    parser.add_argument("--queries", type=int, default=200, help="queries per search/summarize run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak-memory runs")
+    parser.add_argument("--work-dir", help="keep generated corpora here and reuse them across runs")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON file to write results to")
+    parser.add_argument("--compare", help="earlier results JSON; exits non-zero on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative growth that counts as a regression (default 0.20)")
+    parser.add_argument("--generate", metavar="DIR",
+                        help="only write --sizes[0] synthetic chunks to DIR (e.g. a processed_data copy)")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_corpus(args.generate, args.sizes[0], load_sample_texts(), args.seed)
+        print(f"Wrote {args.sizes[0]} chunks to {os.path.join(args.generate, 'synthetic')}")
+        sys.exit(0)
+
+    report = run_suite(args.sizes, args.queries, args.seed, not args.no_memory, args.work_dir)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(baseline, report, args.threshold) else 0)
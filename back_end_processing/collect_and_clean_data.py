@@ -1,5 +1,11 @@
 import os
 import sys
+import json
+import time
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 from PyPDF2 import PdfReader
 import re
 
@@ -8,9 +14,16 @@ if project_root not in sys.path:
     sys.path.append(project_root)
 
 from APP.services.preprocessing_data import Preprocessor
+from APP.services.sources import source_label_for
 
 RAW_DIR = os.path.join(project_root, "data", "raw_notes")
 PROCESSED_DIR = os.path.join(project_root, "data", "processed_data")
+MANIFEST_FILE = os.path.join(PROCESSED_DIR, "ingest_manifest.json")
+
+MAX_TASKS_PER_WORKER = 8
+CHUNK_SIZE = 280
+# Characters of cleaned text kept per PDF; 0 indexes whole books.
+MAX_CHARS = 60000
 
 processor = Preprocessor()
 
@@ -34,109 +47,346 @@ def clean_pdf_extraction(text):
     return text.strip()
 
 
-def convert_pdf_to_text(pdf_path):
-    reader = PdfReader(pdf_path)
-    text = ""
+def iter_pdf_text(pdf_path, max_chars=MAX_CHARS, stats=None):
+    """Yields cleaned text page by page, stopping once max_chars have been produced (0 = no limit)."""
+    remaining = max_chars
+    carry = ""
 
-    for page in reader.pages:
-        extracted = page.extract_text()
-        if extracted:
-            text += extracted + "\n"
+    with open(pdf_path, "rb") as f:
+        reader = PdfReader(f)
 
-    text = re.sub(r"(\w+)-\s*\n\s*(\w+)", r"\1\2", text)
-    
-    clean_text = clean_pdf_extraction(text)
+        for page in reader.pages:
+            extracted = page.extract_text()
+            if stats is not None:
+                stats["pages"] += 1
+            if not extracted:
+                continue
 
-    if len(clean_text) > 60000:
-        clean_text = clean_text[:60000]
+            text = carry + extracted + "\n"
 
-    return clean_text
+            # A word hyphenated across the page break is completed on the next page.
+            carry = ""
+            m = re.search(r"(\w+-)\s*$", text)
+            if m:
+                carry = m.group(1) + "\n"
+                text = text[:m.start()]
 
-def collect_and_clean():
-    print(f"Starting data collection and cleaning...")
-    print(f"Reading raw notes from: {RAW_DIR}")
-    print(f"Writing processed data to: {PROCESSED_DIR}")
+            text = re.sub(r"(\w+)-\s*\n\s*(\w+)", r"\1\2", text)
+            clean_text = clean_pdf_extraction(text)
+            if not clean_text:
+                continue
 
-    os.makedirs(PROCESSED_DIR, exist_ok=True)
+            if max_chars and len(clean_text) >= remaining:
+                yield clean_text[:remaining]
+                return
+
+            remaining -= len(clean_text) + 1
+            yield clean_text
+
+        if carry:
+            clean_text = clean_pdf_extraction(carry)
+            yield clean_text[:remaining] if max_chars else clean_text
+
+
+def convert_pdf_to_text(pdf_path, max_chars=MAX_CHARS):
+    return " ".join(iter_pdf_text(pdf_path, max_chars))
+
+
+def iter_chunks(pieces, chunk_size=CHUNK_SIZE):
+    """Groups the words of a stream of text pieces into chunk_size-word chunks."""
+    words = []
+    for piece in pieces:
+        words.extend(piece.split())
+        while len(words) >= chunk_size:
+            yield " ".join(words[:chunk_size])
+            del words[:chunk_size]
+    if words:
+        yield " ".join(words)
+
+
+def find_raw_files(max_chars=MAX_CHARS):
+    """Lists (file_path, file, source_folder, out_dir, max_chars) in a stable order, one entry per output name."""
+    tasks = []
+    claimed = {}
 
     for root, dirs, files in os.walk(RAW_DIR):
+        dirs.sort()
         rel_path = os.path.relpath(root, RAW_DIR)
         if rel_path == ".":
             continue
 
         source_folder = rel_path.split(os.sep)[0]
-        out_dir = os.path.join(PROCESSED_DIR, source_folder)
-        os.makedirs(out_dir, exist_ok=True)
 
-        for file in files:
+        for file in sorted(files):
             file_path = os.path.join(root, file)
-            text = ""
-
-            if file.lower().endswith(".pdf"):
-                print(f"  Converting PDF: {file} ({source_folder})")
-                try:
-                    text = convert_pdf_to_text(file_path)
-                except Exception as e:
-                    print(f"  ERROR processing PDF '{file}': {e}")
-                    continue
-
-            elif file.lower().endswith(".txt"):
-                print(f"  Reading TXT: {file} ({source_folder})")
-                try:
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        text = f.read()
-                except Exception as e:
-                    print(f"  ERROR reading TXT '{file}': {e}")
-                    continue
-
-            else:
+            if not file.lower().endswith((".pdf", ".txt")):
                 print(f"  Skipping unsupported file: {file}")
                 continue
+            base_name = file.replace(".pdf", "").replace(".txt", "")
 
-            if not text or len(text.strip()) == 0:
-                print(f"  WARNING: Empty extract for {file}")
+            key = (source_folder, base_name)
+            if key in claimed:
+                print(f"  WARNING: Skipping {file_path}, its output name is already used by {claimed[key]}")
                 continue
+            claimed[key] = file_path
+
+            tasks.append((file_path, file, source_folder, os.path.join(PROCESSED_DIR, source_folder), max_chars))
+
+    return tasks
 
-            clean_text = processor.clean_text(text)
 
-            lower_path = file_path.lower()
+def write_chunk(out_path, chunk):
+    """Atomically writes a chunk; returns False if the file already holds this exact text."""
+    data = chunk.encode("utf-8")
+
+    try:
+        with open(out_path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, out_path)
+    return True
+
+
+def iter_text_file(file_path):
+    with open(file_path, "r", encoding="utf-8") as f:
+        yield f.read()
+
+
+def process_file(task):
+    """Converts and chunks one raw file. Runs in a worker process when --workers > 1.
+
+    Text streams from the extractor through cleaning into the chunker, and each
+    chunk is written as soon as it is complete, so memory does not grow with
+    the size of the document.
+    """
+    file_path, file, source_folder, out_dir, max_chars = task
+    result = {"ok": False, "pages": 0, "bytes": 0, "chunks": [], "written": [], "log": []}
+    log = result["log"]
+
+    if file.lower().endswith(".pdf"):
+        log.append(f"  Converting PDF: {file} ({source_folder})")
+        pieces = iter_pdf_text(file_path, max_chars, stats=result)
+        error_prefix = f"ERROR processing PDF '{file}'"
+
+    elif file.lower().endswith(".txt"):
+        log.append(f"  Reading TXT: {file} ({source_folder})")
+        pieces = iter_text_file(file_path)
+        error_prefix = f"ERROR reading TXT '{file}'"
+
+    else:
+        log.append(f"  Skipping unsupported file: {file}")
+        return result
+
+    result["bytes"] = os.path.getsize(file_path)
+    base_name = file.replace(".pdf", "").replace(".txt", "")
+
+    try:
+        cleaned = (text for text in map(processor.clean_text, pieces) if text)
+        first = next(cleaned, None)
+
+        if first is None:
+            result["ok"] = True
+            log.append(f"  WARNING: Empty extract for {file}")
+            return result
+
+        # The source is recorded in the ingest manifest and derived from the
+        # chunk's folder at index time, not written into the text.
+        chunks = iter_chunks(itertools.chain([first], cleaned))
+
+        for idx, chunk in enumerate(chunks):
+            out_filename = (
+                f"{base_name}.txt" if idx == 0 else f"{base_name}_{idx}.txt"
+            )
+            out_path = os.path.join(out_dir, out_filename)
+            chunk_rel = f"{source_folder}/{out_filename}"
+
+            try:
+                if write_chunk(out_path, chunk):
+                    result["written"].append(chunk_rel)
+                    log.append(f"  Processed → {chunk_rel}")
+                else:
+                    log.append(f"  Unchanged → {chunk_rel}")
+                result["chunks"].append(chunk_rel)
+            except Exception as e:
+                log.append(f"  ERROR writing file '{out_filename}': {e}")
+                return result
+
+    except Exception as e:
+        log.append(f"  {error_prefix}: {e}")
+        return result
+
+    result["ok"] = True
+    return result
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_ingest_manifest():
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"files": {}}
+    except Exception as e:
+        print(f"  WARNING: Ignoring unreadable ingest manifest: {e}")
+        return {"files": {}}
+
+
+def save_ingest_manifest(manifest):
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+def remove_chunks(chunk_rels):
+    for chunk_rel in chunk_rels:
+        try:
+            os.remove(os.path.join(PROCESSED_DIR, chunk_rel))
+            print(f"  Removed → {chunk_rel}")
+        except FileNotFoundError:
+            pass
+
+
+def collect_and_clean(workers=1, force=False, max_chars=MAX_CHARS):
+    """Ingests new or changed raw files and returns the chunk delta (added/modified/removed)."""
+    print(f"Starting data collection and cleaning...")
+    print(f"Reading raw notes from: {RAW_DIR}")
+    print(f"Writing processed data to: {PROCESSED_DIR}")
 
-            if "reading_materials" in lower_path or "materials" in lower_path:
-                source_label = "B.Tech CS Materials"
-            elif "mit_opencourseware" in lower_path or "mit" in lower_path:
-                source_label = "MIT OpenCourseWare"
-            elif "openstax" in lower_path:
-                source_label = "OpenStax"
-            elif "opentextbooklibrary" in lower_path or "opentextbook" in lower_path:
-                source_label = "Open Textbook Library"
-            else:
-                source_label = "General Resource"
+    os.makedirs(PROCESSED_DIR, exist_ok=True)
 
-            clean_text = f"[SOURCE: {source_label}] {clean_text}"
+    manifest = load_ingest_manifest()
+    entries = manifest["files"]
 
-            words = clean_text.split()
-            chunk_size = 280
-            chunks = [
-                " ".join(words[i:i + chunk_size])
-                for i in range(0, len(words), chunk_size)
-            ]
+    if manifest.get("max_chars") != max_chars:
+        if entries:
+            print(f"Character budget changed to {max_chars}, re-processing every raw file.")
+        force = True
+    manifest["max_chars"] = max_chars
+    delta = {"added": [], "modified": [], "removed": []}
 
-            base_name = file.replace(".pdf", "").replace(".txt", "")
+    tasks = find_raw_files(max_chars)
+    current = set()
+    pending = []
+
+    for task in tasks:
+        raw_rel = os.path.relpath(task[0], RAW_DIR)
+        current.add(raw_rel)
 
-            for idx, chunk in enumerate(chunks):
-                out_filename = (
-                    f"{base_name}.txt" if idx == 0 else f"{base_name}_{idx}.txt"
-                )
-                out_path = os.path.join(out_dir, out_filename)
+        st = os.stat(task[0])
+        entry = entries.get(raw_rel)
+        if not force and entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+            continue
 
-                try:
-                    with open(out_path, "w", encoding="utf-8") as f:
-                        f.write(chunk)
-                    print(f"  Processed → {source_folder}/{out_filename}")
-                except Exception as e:
-                    print(f"  ERROR writing file '{out_filename}': {e}")
+        digest = file_sha1(task[0])
+        if not force and entry and entry["sha1"] == digest:
+            entry["size"], entry["mtime"] = st.st_size, st.st_mtime_ns
+            continue
 
+        pending.append((task, raw_rel, st, digest))
+
+    for raw_rel in sorted(set(entries) - current):
+        print(f"  Raw file removed: {raw_rel}")
+        remove_chunks(entries[raw_rel]["chunks"])
+        delta["removed"].extend(entries.pop(raw_rel)["chunks"])
+
+    print(f"{len(pending)} of {len(tasks)} raw files are new or changed.")
+
+    for out_dir in sorted({task[3] for task, _, _, _ in pending}):
+        os.makedirs(out_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    totals = {"files": 0, "pages": 0, "bytes": 0, "chunks": 0}
+
+    if workers > 1:
+        # Workers are recycled after a few files so a huge PDF cannot keep
+        # its memory pinned for the rest of the run.
+        executor = ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=MAX_TASKS_PER_WORKER)
+        results = executor.map(process_file, [task for task, _, _, _ in pending])
+    else:
+        executor = None
+        results = map(process_file, [task for task, _, _, _ in pending])
+
+    try:
+        # map() yields in submission order, so logs read the same for any worker count.
+        for (task, raw_rel, st, digest), result in zip(pending, results):
+            for line in result["log"]:
+                print(line)
+            totals["files"] += 1
+            totals["pages"] += result["pages"]
+            totals["bytes"] += result["bytes"]
+            totals["chunks"] += len(result["chunks"])
+
+            old_chunks = set(entries[raw_rel]["chunks"]) if raw_rel in entries else set()
+            new_chunks = set(result["chunks"])
+
+            if not result["ok"]:
+                # Keep every chunk on record (old and partially rewritten) and
+                # force a retry on the next run.
+                entries[raw_rel] = {
+                    "size": -1,
+                    "mtime": -1,
+                    "sha1": None,
+                    "chunks": sorted(old_chunks | new_chunks),
+                }
+                continue
+
+            orphans = sorted(old_chunks - new_chunks)
+            remove_chunks(orphans)
+
+            delta["removed"].extend(orphans)
+            delta["added"].extend(c for c in result["chunks"] if c not in old_chunks)
+            delta["modified"].extend(c for c in result["written"] if c in old_chunks)
+
+            entries[raw_rel] = {
+                "size": st.st_size,
+                "mtime": st.st_mtime_ns,
+                "sha1": digest,
+                "source": source_label_for(raw_rel),
+                "chunks": result["chunks"],
+            }
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+        manifest["last_delta"] = delta
+        save_ingest_manifest(manifest)
+
+    elapsed = time.perf_counter() - start
+    mb = totals["bytes"] / (1024 * 1024)
+    print(
+        f"Processed {totals['files']} files ({totals['pages']} pages, {mb:.1f} MB) "
+        f"into {totals['chunks']} chunks in {elapsed:.1f}s with {workers} worker(s): "
+        f"{totals['pages'] / elapsed if elapsed else 0:.1f} pages/s, "
+        f"{mb / elapsed if elapsed else 0:.2f} MB/s"
+    )
+    print(
+        f"Chunks added: {len(delta['added'])}, modified: {len(delta['modified'])}, "
+        f"removed: {len(delta['removed'])}"
+    )
     print("Data collection and cleaning finished.")
 
+    return delta
+
 if __name__ == "__main__":
-    collect_and_clean()
+    parser = argparse.ArgumentParser(description="Convert raw notes into processed text chunks.")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--force", action="store_true", help="re-process raw files even if unchanged")
+    parser.add_argument("--max-chars", type=int, default=MAX_CHARS,
+                        help=f"characters of text kept per PDF, 0 for whole documents (default: {MAX_CHARS})")
+    args = parser.parse_args()
+
+    collect_and_clean(workers=max(args.workers, 1), force=args.force, max_chars=max(args.max_chars, 0))
@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import urllib.parse
+import urllib.request
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from back_end_processing.benchmark_ir import load_sample_texts, make_queries
+
+SERVE_SCRIPT = os.path.join(project_root, "serve.py")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(url, proc, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("server exited before it was ready")
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.25)
+    raise RuntimeError(f"server not ready after {timeout}s")
+
+
+def run_load(base_url, queries, concurrency, duration):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(worker_id):
+        nonlocal errors
+        rng = random.Random(worker_id)
+        while time.perf_counter() < stop_at:
+            body = urllib.parse.urlencode({"query": rng.choice(queries)}).encode()
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(base_url + "/perform_search", data=body, timeout=60).read()
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+            except OSError:
+                with lock:
+                    errors += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000 if latencies else 0.0
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / wall,
+        "p50": pct(0.50),
+        "p95": pct(0.95),
+    }
+
+
+def bench_workers(worker_counts, concurrency, duration, queries, startup_timeout):
+    print(f"{'workers':>8} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50':>9} {'p95':>9} {'speedup':>8}")
+
+    baseline = None
+    for workers in worker_counts:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        proc = subprocess.Popen(
+            [sys.executable, SERVE_SCRIPT, "--bind", f"127.0.0.1:{port}", "--workers", str(workers)],
+            cwd=project_root,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_until_ready(base_url + "/", proc, startup_timeout)
+            stats = run_load(base_url, queries, concurrency, duration)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+        baseline = baseline or stats["rps"]
+        print(f"{workers:>8} {stats['requests']:>9} {stats['errors']:>7} {stats['rps']:>8.1f} "
+              f"{stats['p50']:>7.1f}ms {stats['p95']:>7.1f}ms {stats['rps'] / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure /perform_search throughput per gunicorn worker count.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent client threads")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds of load per worker count")
+    parser.add_argument("--queries", type=int, default=2000, help="distinct queries to draw from")
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    # Many distinct queries so most requests miss the query cache.
+    queries = make_queries(load_sample_texts(), args.queries)
+    bench_workers(args.workers, args.concurrency, args.duration, queries, args.startup_timeout)
@@ -0,0 +1,310 @@
+import os
+import sys
+import math
+import random
+import shutil
+import tempfile
+from collections import Counter, defaultdict
+
+import numpy as np
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from APP.services import index_store, spelling
+from APP.services.ir_engine import IREngine
+from APP.services.sources import source_label_for
+from APP.services.nltk_resources import ensure_nltk_resources
+from back_end_processing.benchmark_ir import load_sample_texts, make_queries, make_phrase_queries
+
+# Processed-data folders the sample documents are spread over, one per source.
+SOURCE_FOLDERS = ["OpenStax", "MIT_OpenCourseWare", "OpenTextbookLibrary", "reading_materials"]
+SAMPLE_DOCS = 120
+N_QUERIES = 40
+N_TYPOS = 200
+
+
+class Checks:
+    def __init__(self):
+        self.failures = 0
+
+    def check(self, ok, what):
+        if not ok:
+            self.failures += 1
+            print(f"  FAIL: {what}")
+        return ok
+
+
+def write_corpus(folder, texts):
+    for i, text in enumerate(texts):
+        source_dir = os.path.join(folder, SOURCE_FOLDERS[i % len(SOURCE_FOLDERS)])
+        os.makedirs(source_dir, exist_ok=True)
+        with open(os.path.join(source_dir, f"doc_{i:04d}.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+def check_codecs(checks, rng):
+    print("Postings and positions encoding round-trip")
+    for _ in range(200):
+        doc_ids = sorted(rng.sample(range(1 << 20), rng.randint(0, 50)))
+        postings = [(doc_id, rng.choice([1, 2, 127, 128, 16384, 1 << 35])) for doc_id in doc_ids]
+        out = bytearray()
+        index_store.encode_postings(postings, out)
+        checks.check(index_store.decode_postings(out) == postings, f"postings {postings[:3]}...")
+
+        positions = sorted(rng.sample(range(1 << 16), rng.randint(1, 30)))
+        data = index_store.encode_positions(positions)
+        checks.check(index_store.decode_positions(data) == positions, f"positions {positions[:3]}...")
+
+
+def check_index_file(checks, folder, rng):
+    """write_index and the Mapped* readers on hand-built sections."""
+    print("index.bin sections round-trip")
+    n_docs = 300
+    terms = ["algorithm", "algorithms", "binary", "naïve", "protocol", "protocols", "tree", "zeta"]
+    inverted_index, term_positions = {}, {}
+    for term in terms:
+        doc_ids = sorted(rng.sample(range(n_docs), rng.randint(spelling.MIN_DF, 40)))
+        positions = [sorted(rng.sample(range(5000), rng.randint(1, 5))) for _ in doc_ids]
+        inverted_index[term] = [(doc_id, len(p)) for doc_id, p in zip(doc_ids, positions)]
+        term_positions[term] = [index_store.encode_positions(p) for p in positions]
+    words = {"algorithm": "algorithm", "binary": "binary", "protocol": "protocol"}
+    doc_sources = [rng.choice(["MIT OpenCourseWare", "OpenStax", "Open Textbook Library"]) for _ in range(n_docs)]
+
+    sections = index_store.build_term_sections(inverted_index, words)
+    sections.update(index_store.build_spelling_sections(sections))
+    sections.update(index_store.build_position_sections(term_positions))
+    labels, source_sections = index_store.build_source_sections(doc_sources)
+    sections.update(source_sections)
+    # MappedPositions reads doc IDs from the BM25 doc-order section.
+    sections["bm25doc"] = np.array(
+        [doc_id for term in sorted(inverted_index) for doc_id, _ in inverted_index[term]], dtype=np.uint32
+    )
+    meta = {"N": n_docs, "sources": labels, "note": "round-trip"}
+    path = os.path.join(folder, "sections.bin")
+    index_store.write_index(path, meta, sections)
+
+    mapped = index_store.MappedFile(path)
+    checks.check(mapped.meta == meta, "meta")
+    postings = index_store.MappedTermPostings(mapped.sections)
+    checks.check(dict(postings.items()) == inverted_index, "postings")
+    checks.check(postings.term_id("missing") == -1 and "missing" not in postings, "unknown term")
+    for term in terms:
+        term_id = postings.term_id(term)
+        checks.check(postings.word(term_id) == words.get(term, term), f"display word of {term!r}")
+        checks.check(postings.df[term] == len(inverted_index[term]), f"df of {term!r}")
+
+    positions = index_store.MappedPositions(mapped.sections, postings)
+    for term in terms:
+        term_id = postings.term_id(term)
+        decoded = [positions.positions(term_id, i) for i in range(len(inverted_index[term]))]
+        expected = [index_store.decode_positions(data) for data in term_positions[term]]
+        checks.check(decoded == expected, f"positions of {term!r}")
+        checks.check(positions.docs(term_id).tolist() == [doc_id for doc_id, _ in inverted_index[term]],
+                     f"position doc IDs of {term!r}")
+
+    sources = index_store.MappedSources(mapped.sections, labels, n_docs)
+    checks.check([sources.label(doc_id) for doc_id in range(n_docs)] == doc_sources, "source labels")
+    checks.check(sources.counts(list(range(n_docs))) == dict(Counter(doc_sources)), "source counts")
+
+    corrections = index_store.MappedSpelling(mapped.sections, postings)
+    checks.check(corrections.correct("protocal") == "protocol", "spelling of 'protocal'")
+    checks.check(corrections.correct("qwertyuiop") is None, "spelling of 'qwertyuiop'")
+
+    with open(path, "r+b") as f:
+        f.write(b"XXXX")
+    try:
+        index_store.MappedFile(path)
+        checks.check(False, "a file with a bad magic number was read")
+    except ValueError:
+        pass
+
+
+def check_against_recount(checks, engine):
+    """The saved index against postings, lengths and norms recounted from the documents."""
+    print(f"Saved index vs a recount of the documents (positional={engine.positional})")
+    inverted_index = defaultdict(list)
+    term_positions = defaultdict(list)
+    doc_lengths = []
+    for doc_id in range(engine.N):
+        text = engine.get_document_text(doc_id)
+        positioned = engine.preprocess_positions(text)
+        by_term = defaultdict(list)
+        for pos, term in positioned:
+            by_term[term].append(pos)
+        for term, positions in by_term.items():
+            inverted_index[term].append((doc_id, len(positions)))
+            term_positions[term].append(positions)
+        doc_lengths.append(len(positioned))
+
+    checks.check(sorted(engine.inverted_index) == sorted(inverted_index), "vocabulary")
+    mismatched = [t for t in inverted_index if engine.inverted_index.get(t) != inverted_index[t]]
+    checks.check(not mismatched, f"postings of {mismatched[:5]}")
+    checks.check(list(engine.doc_lengths) == doc_lengths, "document lengths")
+    checks.check(math.isclose(engine.avgdl, sum(doc_lengths) / engine.N), "average document length")
+
+    squared = [0.0] * engine.N
+    for term, postings in inverted_index.items():
+        idf = math.log(engine.N / len(postings))
+        for doc_id, freq in postings:
+            squared[doc_id] += (freq * idf) ** 2
+    checks.check(all(math.isclose(norm, math.sqrt(s), rel_tol=1e-9, abs_tol=1e-12)
+                     for norm, s in zip(engine.doc_norms, squared)), "TF-IDF norms")
+
+    checks.check(all(engine.sources.label(doc_id) == source_label_for(path)
+                     for doc_id, path in enumerate(engine.doc_filenames)), "document sources")
+
+    if engine.positional:
+        bad = []
+        for term, expected in term_positions.items():
+            term_id = engine.inverted_index.term_id(term)
+            if [engine.positions.positions(term_id, i) for i in range(len(expected))] != expected:
+                bad.append(term)
+        checks.check(not bad, f"positions of {bad[:5]}")
+
+
+def snapshot(engine, queries):
+    """Everything searches depend on, keyed by document path so doc IDs may differ."""
+    rel = [os.path.relpath(path, engine.processed_data_folder) for path in engine.doc_filenames]
+
+    def by_path(ranked):
+        return sorted((rel[doc_id], round(score, 9)) for doc_id, score in ranked if score > 0)
+
+    state = {
+        "N": engine.N,
+        "avgdl": round(engine.avgdl, 9),
+        "documents": sorted(
+            (rel[doc_id], engine.doc_lengths[doc_id], round(engine.doc_norms[doc_id], 9),
+             engine.sources.label(doc_id), engine.doc_paragraphs[doc_id])
+            for doc_id in range(engine.N)
+        ),
+        "postings": {term: sorted((rel[doc_id], freq) for doc_id, freq in postings)
+                     for term, postings in engine.inverted_index.items()},
+        "rankings": {(model, q): by_path(engine.rank(q, top_k=engine.N, model=model)[1])
+                     for model in ("tfidf", "bm25") for q in queries},
+    }
+    if engine.positional:
+        state["phrases"] = {}
+        for q in queries:
+            _, phrases = engine.parse_query(q)
+            if phrases:
+                state["phrases"][q] = sorted(rel[doc_id] for doc_id in engine.phrase_matches(phrases).tolist())
+    return state
+
+
+def check_incremental_update(checks, corpus, folder, queries, positional):
+    """Removing, changing, adding and touching files, then update_index, must
+    give the same index as building the changed corpus from scratch."""
+    print(f"Incremental update vs scratch build (positional={positional})")
+    updated_dir = os.path.join(folder, f"updated_{positional}")
+    shutil.copytree(corpus, updated_dir)
+    IREngine(updated_dir, positional=positional)
+
+    source_dir = os.path.join(updated_dir, SOURCE_FOLDERS[0])
+    files = sorted(os.listdir(source_dir))
+    os.remove(os.path.join(source_dir, files[0]))
+    with open(os.path.join(source_dir, files[1]), "a", encoding="utf-8") as f:
+        f.write(" binary search tree protocol")
+    shutil.copy(os.path.join(source_dir, files[2]), os.path.join(source_dir, "added.txt"))
+    os.utime(os.path.join(source_dir, files[3]))
+
+    updated = IREngine(updated_dir, positional=positional)
+    reopened = IREngine(updated_dir, positional=positional)
+
+    scratch_dir = os.path.join(folder, f"scratch_{positional}")
+    shutil.copytree(updated_dir, scratch_dir, ignore=shutil.ignore_patterns("*.bin"))
+    scratch = IREngine(scratch_dir, positional=positional)
+
+    expected = snapshot(scratch, queries)
+    got = snapshot(updated, queries)
+    for key in expected:
+        checks.check(got[key] == expected[key], f"updated index differs from scratch build in {key!r}")
+    checks.check(snapshot(reopened, queries) == got, "reopening the updated index changed it")
+
+
+def check_phrases(checks, engine, queries):
+    print("Phrase matching vs a brute-force scan")
+    texts = [dict(engine.preprocess_positions(engine.get_document_text(doc_id))) for doc_id in range(engine.N)]
+
+    checked = 0
+    for q in queries:
+        _, phrases = engine.parse_query(q)
+        for phrase in phrases:
+            expected = [
+                doc_id for doc_id, by_pos in enumerate(texts)
+                if any(all(by_pos.get(start + offset) == term for offset, term in phrase)
+                       for start, term in by_pos.items() if term == phrase[0][1])
+            ]
+            checks.check(engine.phrase_docs(phrase).tolist() == expected, f"phrase {q}")
+            checked += 1
+    print(f"  {checked} phrases checked")
+
+
+def check_spelling(checks, engine, rng):
+    print("Spelling corrections vs a brute-force scan")
+    dictionary = [
+        (word, df) for word, df in engine.vocabulary()
+        if df >= spelling.MIN_DF and len(word) >= spelling.MIN_DICTIONARY_LENGTH and word.isalpha()
+    ]
+    words = [word for word, _ in dictionary if len(word) >= 5]
+    if not words:
+        print("  WARNING: no dictionary words to misspell.")
+        return
+
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    for _ in range(N_TYPOS):
+        word = rng.choice(words)
+        i = rng.randrange(len(word) - 1)
+        typo = rng.choice([
+            word[:i] + word[i + 1:],
+            word[:i] + rng.choice(letters) + word[i + 1:],
+            word[:i] + word[i + 1] + word[i] + word[i + 2:],
+        ])
+        max_distance = spelling.max_distance_for(typo)
+        best = None
+        if max_distance:
+            for candidate, df in dictionary:
+                distance = spelling.edit_distance(typo, candidate, max_distance)
+                if distance <= max_distance and (best is None or (distance, -df, candidate) < best):
+                    best = (distance, -df, candidate)
+        expected = best[2] if best else None
+        checks.check(engine.spelling.correct(typo) == expected, f"correction of {typo!r}")
+
+
+def run_ir_index_tests():
+    print("--- Running IR Index Tests ---")
+    ensure_nltk_resources()
+    rng = random.Random(0)
+    checks = Checks()
+
+    sample_texts = load_sample_texts()[:SAMPLE_DOCS]
+    if not sample_texts:
+        print("WARNING: No processed documents found. Ensure 'collect_and_clean_data.py' has been run.")
+        return 0
+    queries = make_queries(sample_texts, N_QUERIES) + make_phrase_queries(sample_texts, N_QUERIES)
+
+    with tempfile.TemporaryDirectory() as folder:
+        check_codecs(checks, rng)
+        check_index_file(checks, folder, rng)
+
+        corpus = os.path.join(folder, "corpus")
+        write_corpus(corpus, sample_texts)
+
+        for positional in (False, True):
+            engine_dir = os.path.join(folder, f"engine_{positional}")
+            shutil.copytree(corpus, engine_dir)
+            engine = IREngine(engine_dir, positional=positional)
+            check_against_recount(checks, engine)
+            if positional:
+                check_phrases(checks, engine, queries)
+            else:
+                check_spelling(checks, engine, rng)
+            check_incremental_update(checks, corpus, folder, queries, positional)
+
+    print(f"--- {checks.failures} failure(s) ---")
+    return checks.failures
+
+
+if __name__ == "__main__":
+    sys.exit(1 if run_ir_index_tests() else 0)
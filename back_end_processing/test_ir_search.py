@@ -5,6 +5,7 @@ if project_root not in sys.path:
     sys.path.append(project_root)
 
 from APP.services.ir_engine import IREngine
+from APP.services.nltk_resources import ensure_nltk_resources
 PROCESSED_DATA_DIR = os.path.join(project_root, "data", "processed_data")
 
 def run_ir_search_tests():
@@ -12,9 +13,10 @@ def run_ir_search_tests():
     print(f"Initializing IREngine with processed data from: {PROCESSED_DATA_DIR}")
 
     try:
+        ensure_nltk_resources()
         ir_engine = IREngine(PROCESSED_DATA_DIR)
         
-        if not ir_engine.docs:
+        if not ir_engine.N:
             print("WARNING: IREngine has no documents loaded. Ensure 'collect_and_clean_data.py' has been run.")
             return
 
@@ -6,6 +6,7 @@ if project_root not in sys.path:
     sys.path.append(project_root)
 
 from APP.services.ir_engine import IREngine
+from APP.services.nltk_resources import ensure_nltk_resources
 from APP.services.summarizer import Summarizer 
 
 PROCESSED_DATA_DIR = os.path.join(project_root, "data", "processed_data")
@@ -15,10 +16,11 @@ def run_ir_summary_tests():
     print(f"Initializing IREngine with processed data from: {PROCESSED_DATA_DIR}")
 
     try:
+        ensure_nltk_resources()
         ir_engine = IREngine(PROCESSED_DATA_DIR)
         summarizer = Summarizer() 
 
-        if not ir_engine.docs:
+        if not ir_engine.N:
             print("WARNING: IREngine has no documents loaded. Ensure 'collect_and_clean_data.py' has been run.")
             return
 
@@ -47,7 +49,7 @@ def run_ir_summary_tests():
 
             print("\n  Summary of top relevant paragraph:")
             try:
-                summary_text = summarizer.summarize(top_paragraph, sentence_count=3)
+                summary_text = summarizer.summarize(top_paragraph, q, max_sentences=3)
                 print(f"    {summary_text}")
             except Exception as e:
                 print(f"    Error summarizing paragraph: {e}")
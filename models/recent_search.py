@@ -2,6 +2,11 @@ from extensions import db
 import datetime
 
 class RecentSearch(db.Model):
+    # Recent searches and suggestions read a user's newest rows first.
+    __table_args__ = (
+        db.Index('ix_recent_search_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     # This is the line that needs to be correct to match 'query_text'
@@ -1,15 +1,25 @@
 import os
 import re
-from flask import Blueprint, render_template, request, jsonify, current_app, redirect, url_for, flash
+from flask import Blueprint, render_template, request, jsonify, current_app, redirect, url_for, flash, make_response
 from flask_login import login_required, current_user, login_user, logout_user
-from sqlalchemy import select
+from collections import defaultdict
+from sqlalchemy import select, func
 from sqlalchemy.exc import IntegrityError
 from models.recent_search import RecentSearch
 from models.user import User
 from extensions import db
+from APP.services.metrics import METRICS, span, collect_timings, format_timings
+from APP.services.ir_engine import RANKING_MODELS
+from APP.services.suggest import Suggester, normalize_query, MAX_POPULAR_QUERIES, MIN_POPULAR_USERS
 
 main_bp = Blueprint('main', __name__)
 
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 50
+MAX_BATCH_QUERIES = 1000
+# Past queries of the user checked against the prefix on every keystroke.
+SUGGEST_HISTORY = 100
+
 
 def clean_text(text):
     if not text:
@@ -82,32 +92,32 @@ def search_input_page():
     return render_template('search_screen.html', recent_searches=recent_searches_list)
 
 
-@main_bp.route('/perform_search', methods=['POST'])
-def perform_search_api():
-    query = request.form.get('query')
-    if not query:
-        return jsonify({"error": "Query cannot be empty"}), 400
+def search_unavailable():
+    loader = current_app.config.get('ENGINE_LOADER')
+    if loader is not None and not loader.ready:
+        status = loader.status()
+        if status["status"] == "warming_up":
+            response = jsonify(status)
+            response.headers['Retry-After'] = '1'
+            return response, 503
+    return jsonify({"error": "Search service unavailable"}), 500
 
-    ir_engine = current_app.config.get('IR_ENGINE')
-    summarizer = current_app.config.get('SUMMARIZER')
 
-    if ir_engine is None or summarizer is None:
-        return jsonify({"error": "Search service unavailable"}), 500
+def build_results(ir_engine, summarizer, doc_ids, query, q_tokens):
+    with span("paragraph"):
+        paragraphs = [clean_text(ir_engine.best_paragraph(doc_id, q_tokens)) for doc_id in doc_ids]
+    with span("summarize"):
+        summaries = summarizer.summarize_many(paragraphs, query)
+    with span("format"):
+        return format_results(ir_engine, doc_ids, paragraphs, summaries)
 
-    top_documents = ir_engine.search(query)
-    results = []
 
-    if current_user.is_authenticated:
-        new_search = RecentSearch(user_id=current_user.id, query_text=query)
-        db.session.add(new_search)
-        db.session.commit()
-
-    for doc_data in top_documents:
-
-        filepath = doc_data["filename"]
-
-        raw_paragraph = clean_text(doc_data["paragraph"])
-        score = doc_data["score"]
+def format_results(ir_engine, doc_ids, paragraphs, summaries):
+    """Result entries without a score, which depends on the ranking model and
+    is added by scored_results."""
+    results = []
+    for doc_id, raw_paragraph, snippet in zip(doc_ids, paragraphs, summaries):
+        filepath = ir_engine.doc_filenames[doc_id]
 
         display_title = clean_display_title(filepath.split("/")[-1])
         heading = extract_heading(raw_paragraph)
@@ -117,7 +127,6 @@ def perform_search_api():
         else:
             full_title = display_title
 
-        snippet = summarizer.summarize(raw_paragraph, query)
         snippet = clean_text(snippet)
         snippet = enforce_min_sentences(snippet, minimum=3)
 
@@ -125,29 +134,273 @@ def perform_search_api():
             fallback_len = 280
             snippet = raw_paragraph[:fallback_len].rsplit(" ", 1)[0] + "..."
 
-        lower_path = filepath.lower()
-
-        if "reading_materials" in lower_path or "materials" in lower_path:
-            source_label = "B.Tech CS Materials"
-        elif "mit_opencourseware" in lower_path:
-            source_label = "MIT OpenCourseWare"
-        elif "openstax" in lower_path:
-            source_label = "OpenStax"
-        elif "opentextbooklibrary" in lower_path or "opentextbook" in lower_path:
-            source_label = "Open Textbook Library"
-        else:
-            source_label = "General Resource"
-
         results.append({
+            "doc_id": doc_id,
             "display_filename": full_title,
             "filename": filepath,
-            "source": source_label,
+            "path": ir_engine.manifest[doc_id]["path"],
+            "source": ir_engine.manifest[doc_id]["source"],
             "snippet": snippet,
-            "score": f"{score:.4f}"
         })
 
+    return results
+
+
+def scored_results(results, hits):
+    return [{**result, "score": f"{score:.4f}"} for result, (_, score) in zip(results, hits)]
+
+
+def cached_ranking(ir_engine, q_tokens, model=None, phrases=None, sources=None):
+    """Returns (ranked, facets) for the query; see IREngine.rank_with_facets."""
+    model = model or ir_engine.ranking_model
+    cache = current_app.config.get('QUERY_CACHE')
+    if cache is None:
+        with span("score"):
+            return ir_engine.rank_with_facets(q_tokens, model=model, phrases=phrases, sources=sources)
+
+    cache.sync_version(ir_engine.index_version)
+    key = cache.make_key(ir_engine.index_version, q_tokens, "rank", ir_engine.scoring_backend, model,
+                         phrases or [], sorted(sources or []))
+
+    entry = cache.get(key)
+    if entry is None:
+        with span("score"):
+            ranked, facets = ir_engine.rank_with_facets(q_tokens, model=model, phrases=phrases, sources=sources)
+        entry = {"ranked": ranked, "facets": facets}
+        cache.put(key, entry)
+    return entry["ranked"], entry["facets"]
+
+
+def cached_results(ir_engine, summarizer, doc_ids, query, q_tokens):
+    cache = current_app.config.get('QUERY_CACHE')
+    if cache is None:
+        return build_results(ir_engine, summarizer, doc_ids, query, q_tokens)
+
+    cache.sync_version(ir_engine.index_version)
+    keys = [cache.make_key(ir_engine.index_version, q_tokens, "result", doc_id) for doc_id in doc_ids]
+    results = [cache.get(key) for key in keys]
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        built = build_results(ir_engine, summarizer, [doc_ids[i] for i in missing], query, q_tokens)
+        for i, result in zip(missing, built):
+            results[i] = result
+        cache.put_many((keys[i], results[i]) for i in missing)
+
+    return results
+
+
+@main_bp.route('/perform_search', methods=['POST'])
+def perform_search_api():
+    METRICS.inc("search_requests_total")
+    with collect_timings() as timings:
+        with span("total"):
+            response = make_response(perform_search())
+
+    # Per-request stage timings, sent when enabled in config or asked for
+    # by the client, for debugging slow queries.
+    if current_app.config.get('SEARCH_TIMING_HEADER') or 'X-Search-Timing' in request.headers:
+        response.headers['X-Search-Timing'] = format_timings(timings)
+    return response
+
+
+def perform_search():
+    query = request.form.get('query')
+    if not query:
+        return jsonify({"error": "Query cannot be empty"}), 400
+
+    offset = max(request.form.get('offset', 0, type=int), 0)
+    limit = min(max(request.form.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+    model = request.form.get('model') or None
+    if model is not None and model not in RANKING_MODELS:
+        return jsonify({"error": f"model must be one of {', '.join(RANKING_MODELS)}"}), 400
+
+    ir_engine = current_app.config.get('IR_ENGINE')
+    summarizer = current_app.config.get('SUMMARIZER')
+
+    if ir_engine is None or summarizer is None:
+        return search_unavailable()
+
+    sources = request.form.getlist('source')
+    unknown = [label for label in sources if label not in ir_engine.sources.labels]
+    if unknown:
+        return jsonify({"error": f"Unknown source: {', '.join(unknown)}"}), 400
+
+    # Misspelled words are corrected and the corrected query is searched in
+    # the same request; exact=1 searches the query as typed.
+    corrected_query = None
+    if request.form.get('exact') != '1':
+        with span("spelling"):
+            corrected_query = ir_engine.correct_query(query)
+    search_query = corrected_query or query
+
+    if current_user.is_authenticated and offset == 0:
+        # Written by the background SearchLogWriter, not in this request.
+        current_app.config['SEARCH_LOG'].log(current_user.id, search_query)
+        suggester = current_app.config.get('SUGGESTER')
+        if suggester is not None:
+            suggester.record_query(search_query, current_user.id)
+
+    with span("preprocess"):
+        q_tokens, phrases = ir_engine.parse_query(search_query)
+    ranked, facets = cached_ranking(ir_engine, q_tokens, model, phrases, sources)
+
+    # Only the requested page gets snippets; the rest of the ranking is
+    # returned as bare hits the page can fetch through /snippet.
+    page = ranked[offset:offset + limit]
+    results = cached_results(ir_engine, summarizer, [doc_id for doc_id, _ in page], search_query, q_tokens)
+    results = scored_results(results, page)
+    hits = [{"doc_id": doc_id, "score": f"{score:.4f}"} for doc_id, score in ranked]
+
+    return jsonify(results=results, hits=hits, query=query, corrected_query=corrected_query,
+                   offset=offset, limit=limit, total=len(ranked),
+                   sources=sources, facets={"source": facets})
+
+
+@main_bp.route('/batch_search', methods=['POST'])
+def batch_search_api():
+    payload = request.get_json(silent=True) or {}
+    queries = payload.get('queries')
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) for q in queries):
+        return jsonify({"error": "queries must be a non-empty list of strings"}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries per batch"}), 400
+
+    try:
+        top_k = min(max(int(payload.get('top_k', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        return jsonify({"error": "top_k must be an integer"}), 400
+    with_paragraphs = bool(payload.get('paragraphs', False))
+
+    model = payload.get('model') or None
+    if model is not None and model not in RANKING_MODELS:
+        return jsonify({"error": f"model must be one of {', '.join(RANKING_MODELS)}"}), 400
+
+    ir_engine = current_app.config.get('IR_ENGINE')
+    if ir_engine is None:
+        return search_unavailable()
+
+    METRICS.inc("batch_search_queries_total", len(queries))
+    with span("batch_score"):
+        batch = ir_engine.search_many(queries, top_k=top_k, with_paragraphs=with_paragraphs, model=model)
+
+    results = []
+    for query, hits in zip(queries, batch):
+        entries = []
+        for hit in hits:
+            entry = {
+                "doc_id": hit["doc_id"],
+                "display_filename": clean_display_title(hit["filename"].split("/")[-1]),
+                "path": ir_engine.manifest[hit["doc_id"]]["path"],
+                "source": hit["source"],
+                "score": f"{hit['score']:.4f}",
+            }
+            if with_paragraphs:
+                entry["paragraph"] = clean_text(hit["paragraph"])
+            entries.append(entry)
+        results.append({"query": query, "hits": entries})
+
+    return jsonify(results=results, top_k=top_k)
+
+
+def load_popular_queries(limit=MAX_POPULAR_QUERIES):
+    """(query, count) of the most searched queries that at least
+    MIN_POPULAR_USERS different users have searched for."""
+    text = func.lower(RecentSearch.query_text)
+    rows = db.session.execute(
+        select(text, func.count())
+        .group_by(text)
+        .having(func.count(RecentSearch.user_id.distinct()) >= MIN_POPULAR_USERS)
+        .order_by(func.count().desc())
+        .limit(limit)
+    )
+
+    counts = defaultdict(int)
+    for query, count in rows:
+        query = normalize_query(query)
+        if query:
+            counts[query] += count
+    return counts.items()
+
+
+def get_suggester(ir_engine):
+    """The app's Suggester, built on first use and given the new vocabulary
+    whenever the index changes."""
+    suggester = current_app.config.get('SUGGESTER')
+    if suggester is None:
+        suggester = Suggester(ir_engine.vocabulary(), load_popular_queries(), ir_engine.index_version)
+        current_app.config['SUGGESTER'] = suggester
+    elif suggester.version != ir_engine.index_version:
+        suggester.update_vocabulary(ir_engine.vocabulary(), ir_engine.index_version)
+    return suggester
+
+
+@main_bp.route('/suggest')
+def suggest_api():
+    METRICS.inc("suggest_requests_total")
+    text = request.args.get('q', '')
+    if not text.strip():
+        return jsonify(query=text, suggestions=[])
+
+    ir_engine = current_app.config.get('IR_ENGINE')
+    if ir_engine is None:
+        return search_unavailable()
+
+    history = []
+    if current_user.is_authenticated:
+        # Served by the (user_id, timestamp) index on recent_search.
+        history = db.session.execute(
+            select(RecentSearch.query_text)
+            .filter_by(user_id=current_user.id)
+            .order_by(RecentSearch.timestamp.desc())
+            .limit(SUGGEST_HISTORY)
+        ).scalars().all()
+
+    suggestions = get_suggester(ir_engine).suggest(text, history)
+    return jsonify(query=text, suggestions=suggestions)
+
+
+@main_bp.route('/metrics')
+def metrics_api():
+    gauges = {"search_log_pending": current_app.config['SEARCH_LOG'].pending()}
+    cache = current_app.config.get('QUERY_CACHE')
+    if cache is not None:
+        gauges["query_cache_entries"] = cache.stats()["entries"]
+
+    response = make_response(METRICS.render(gauges))
+    response.headers['Content-Type'] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
+@main_bp.route('/engine_status')
+def engine_status_api():
+    loader = current_app.config.get('ENGINE_LOADER')
+    if loader is None:
+        return jsonify({"status": "unavailable"})
+    return jsonify(loader.status())
+
+
+@main_bp.route('/snippet', methods=['POST'])
+def snippet_api():
+    query = request.form.get('query')
+    doc_id = request.form.get('doc_id', type=int)
+    if not query or doc_id is None:
+        return jsonify({"error": "Query and doc_id are required"}), 400
+
+    ir_engine = current_app.config.get('IR_ENGINE')
+    summarizer = current_app.config.get('SUMMARIZER')
+
+    if ir_engine is None or summarizer is None:
+        return search_unavailable()
+
+    if not 0 <= doc_id < ir_engine.N:
+        return jsonify({"error": "Unknown document"}), 404
+
+    # No score: the client already has it from the hits of /perform_search.
+    q_tokens = ir_engine.preprocess(query)
 
-    return jsonify(results=results, query=query)
+    return jsonify(cached_results(ir_engine, summarizer, [doc_id], query, q_tokens)[0])
 
 
 @main_bp.route('/login', methods=['GET', 'POST'])
@@ -0,0 +1,111 @@
+import gc
+import os
+import sys
+import argparse
+import multiprocessing
+
+project_root = os.path.abspath(os.path.dirname(__file__))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+from app import create_app
+from extensions import db
+
+DEFAULT_BIND = "127.0.0.1:8000"
+
+
+def warm_up(app):
+    """Touches everything that loads lazily so workers inherit it from the master."""
+    ir_engine = app.config.get('IR_ENGINE')
+    summarizer = app.config.get('SUMMARIZER')
+    if ir_engine is None or summarizer is None:
+        return
+
+    query = "computer networks"
+    q_tokens, ranked = ir_engine.rank(query)
+    if ranked:
+        paragraph = ir_engine.best_paragraph(ranked[0][0], q_tokens)
+        summarizer.summarize_many([paragraph], query)
+
+
+def post_fork(server, worker):
+    app = worker.app.application
+    # Connections opened before fork must not be shared between processes.
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+    cache = app.config.get('QUERY_CACHE')
+    if cache is not None:
+        cache.after_fork()
+
+    search_log = app.config.get('SEARCH_LOG')
+    if search_log is not None:
+        search_log.after_fork()
+
+
+def worker_exit(server, worker):
+    # Searches still queued for the history writer would be lost otherwise.
+    search_log = worker.app.application.config.get('SEARCH_LOG')
+    if search_log is not None:
+        search_log.stop()
+
+
+if BaseApplication is not None:
+    class PreforkApplication(BaseApplication):
+        """Gunicorn application that builds the Flask app once in the master.
+
+        The index is mmapped read-only and loaded before fork, so every worker
+        shares the same pages instead of loading its own copy.
+        """
+
+        def __init__(self, options):
+            self.options = options
+            self.application = None
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            if self.application is None:
+                # Load in the foreground: threads do not survive fork.
+                self.application = create_app(background_load=False)
+                warm_up(self.application)
+                # Keep the preloaded objects out of the collector so workers
+                # do not touch (and copy) their pages on every GC pass.
+                gc.freeze()
+            return self.application
+
+
+def serve(bind=DEFAULT_BIND, workers=None, threads=1, timeout=120):
+    if BaseApplication is None:
+        sys.exit("gunicorn is not installed. Run: pip install -r requirements.txt")
+
+    options = {
+        "bind": bind,
+        "workers": workers or multiprocessing.cpu_count(),
+        "threads": threads,
+        "timeout": timeout,
+        "preload_app": True,
+        "post_fork": post_fork,
+        "worker_exit": worker_exit,
+    }
+    PreforkApplication(options).run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the app with a pre-fork gunicorn server.")
+    parser.add_argument("--bind", default=os.environ.get("BIND", DEFAULT_BIND))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", 0)),
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--threads", type=int, default=1, help="threads per worker")
+    parser.add_argument("--timeout", type=int, default=120)
+    args = parser.parse_args()
+
+    serve(args.bind, args.workers, args.threads, args.timeout)